@@ -1,10 +1,20 @@
 from datetime import date, timedelta
 from functools import partial
-from time import sleep
+import socket
+from time import sleep, monotonic
 from calendar import monthrange
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import numpy as np
 import pandas as pd
-from pytrends.exceptions import ResponseError
-from pytrends.request import TrendReq
+from pytrends.exceptions import ResponseError, TooManyRequestsError
+from requests.exceptions import RequestException
+from fetch_store import FetchStore
+from fetch_telemetry import Telemetry
+from job_queue import JobQueue, load_priorities
+from keyword_quality import hopeless_keywords
+from panel_store import PanelStore
+from trends_session import SessionPool
 import os
 
 
@@ -25,132 +35,710 @@ def convert_dates_to_timeframe(start: date, stop: date) -> str:
     return f"{start.strftime('%Y-%m-%d')} {stop.strftime('%Y-%m-%d')}"
 
 
-def _fetch_data(pytrends, build_payload, timeframe: str) -> pd.DataFrame:
-    """Attempts to fecth data and retries in case of a ResponseError."""
-    attempts, fetched = 0, False
-    while not fetched:
-        try:
-            build_payload(timeframe=timeframe)
-        except ResponseError as err:
-            print(err)
-            print(f'Trying again in {60 + 5 * attempts} seconds.')
-            sleep(60 + 5 * attempts)
-            attempts += 1
-            if attempts > 3:
-                print('Failed after 3 attemps, abort fetching.')
-                break
-        else:
-            fetched = True
-    return pytrends.interest_over_time()
-
-def get_daily_data(word: str,
-                   start_year: int,
-                   start_mon: int,
-                   stop_year: int,
-                   stop_mon: int,
-                   geo: str = 'US',
-                   verbose: bool = True,
-                   wait_time: float = 5.0,
-                   cache=None) -> pd.DataFrame:
-
-    # Set up start and stop dates
-    start_date = date(start_year, start_mon, 1)
-    stop_date = get_last_date_of_month(stop_year, stop_mon)
+def get_month_starts(start: date, stop: date) -> list:
+    """Returns the first day of every month between start and stop."""
+    months = []
+    current = date(start.year, start.month, 1)
+    while current < stop:
+        months.append(current)
+        current = get_last_date_of_month(current.year, current.month) + timedelta(days=1)
+    return months
+
+
+def get_daily_windows(start: date, stop: date, window_days: int = 269, overlap_days: int = 30) -> list:
+    """Splits [start, stop] into windows of window_days days, each one
+    sharing its first overlap_days days with the previous window. Google
+    Trends returns daily data for windows shorter than 270 days."""
+    if not 0 <= overlap_days < window_days:
+        raise ValueError('overlap_days must be between 0 and window_days - 1')
+    windows = []
+    current = start
+    while True:
+        end = min(current + timedelta(days=window_days - 1), stop)
+        windows.append((current, end))
+        if end >= stop:
+            return windows
+        current = end - timedelta(days=overlap_days - 1)
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every fetch worker.
+
+    Tokens refill at `rate` per second up to `burst`. A 429 halves the rate
+    and pauses every worker for `cooldown` seconds (five times as long on
+    every 4th consecutive 429); after `recover_after` successes in a row the
+    rate doubles again, up to the rate the bucket was created with.
+    With `telemetry` set, every request made through timed_fetch is recorded.
+    """
 
-    # Start pytrends for US region outside the loop
-    pytrends = TrendReq(hl='en-US', tz=360)
-    # Initialize build_payload with the word we need data for
-    build_payload = partial(pytrends.build_payload,
-                            kw_list=[word], cat=0, geo=geo, gprop='')
-
-    # Obtain monthly data for all months in years [start_year, stop_year]
-    if cache is None or 'monthly' not in cache:
-        monthly = _fetch_data(pytrends, build_payload,
-                             convert_dates_to_timeframe(start_date, stop_date))
-        cache['monthly'] = monthly
-    else:
-        monthly = cache['monthly']
+    def __init__(self, rate: float, burst: int = 1, min_rate: float = 1 / 300,
+                 cooldown: float = 60.0, recover_after: int = 10, telemetry: Telemetry = None):
+        self.telemetry = telemetry
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.cooldown = cooldown
+        self.recover_after = recover_after
+        self.sent = 0
+        self.started = monotonic()
+        self._tokens = float(burst)
+        self._updated = self.started
+        self._paused_until = 0.0
+        self._successes = 0
+        self._throttles = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Blocks until the caller is allowed to send one request and
+        returns the seconds it waited."""
+        started = monotonic()
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.sent += 1
+                    return now - started
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._throttles = 0
+            self._successes += 1
+            if self._successes >= self.recover_after and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate * 2)
+                self._successes = 0
+
+    def on_throttle(self) -> float:
+        """Backs off after a 429 and returns how long the workers will pause."""
+        with self._lock:
+            now = monotonic()
+            # Requests sent before the current pause started fail together,
+            # only the first of them should slow the bucket down
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._successes = 0
+            self._throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = self.cooldown * 5 if self._throttles % 4 == 0 else self.cooldown
+            self._paused_until = now + pause
+            self._tokens = 0.0
+            return pause
+
+    def requests_per_minute(self) -> float:
+        elapsed = monotonic() - self.started
+        return 60 * self.sent / elapsed if elapsed > 0 else 0.0
+
+
+class AIMDBucket(TokenBucket):
+    """Token bucket searching for the highest request rate Google tolerates.
+
+    Additive increase, multiplicative decrease: every `recover_after`
+    successes in a row the rate grows by `increase` requests per second, up
+    to `ceiling`, and every 429 multiplies it by `decrease`. The pause after
+    a 429 doubles with every consecutive 429, up to max_cooldown, instead of
+    the fixed 60 and 300 second sleeps. Rate changes are written to the
+    telemetry file.
+    """
 
-    # Get daily data, month by month
-    results = {}
-    last_successful_month = None  # Track the last successful month retrieved
-    consecutive_errors = 0  # Track consecutive 429 errors
-
-    current = start_date if 'last_successful_month' not in cache else cache['last_successful_month']
-    while current < stop_date:
-        # Re-initialize TrendReq instance if there's an error
-        pytrends = TrendReq(hl='en-US', tz=360)
-        build_payload = partial(pytrends.build_payload,
-                                kw_list=[word], cat=0, geo=geo, gprop='')
-
-        last_date_of_month = get_last_date_of_month(current.year, current.month)
-        timeframe = convert_dates_to_timeframe(current, last_date_of_month)
-        if verbose:
-            print(f'{word}:{timeframe}')
-
-        try:
-            if timeframe not in cache:
-                results[current] = _fetch_data(pytrends, build_payload, timeframe)
-                cache[timeframe] = results[current]
-            else:
-                results[current] = cache[timeframe]
-
-        except ResponseError as err:
-            print(err)
-            consecutive_errors += 1
-            if consecutive_errors % 4 == 0:  # Check for every 4 consecutive errors
-                print(f'Trying again in 300 seconds after {consecutive_errors} consecutive 429 errors.')
-                sleep(300)  # Sleep for 300 seconds after every 4 consecutive errors
+    def __init__(self, rate: float, burst: int = 1, ceiling: float = 1.0, increase: float = 0.01,
+                 decrease: float = 0.5, min_rate: float = 1 / 300, cooldown: float = 60.0,
+                 max_cooldown: float = 900.0, recover_after: int = 10, telemetry: Telemetry = None):
+        super().__init__(rate, burst=burst, min_rate=min_rate, cooldown=cooldown,
+                         recover_after=recover_after, telemetry=telemetry)
+        self.max_rate = ceiling
+        self.increase = increase
+        self.decrease = decrease
+        self.max_cooldown = max_cooldown
+
+    def _rate_changed(self, reason: str):
+        if self.telemetry is not None:
+            self.telemetry.record('rate', rate=self.rate, wait_time=1 / self.rate, reason=reason)
+
+    def on_success(self):
+        with self._lock:
+            self._throttles = 0
+            self._successes += 1
+            if self._successes < self.recover_after or self.rate >= self.max_rate:
+                return
+            self._successes = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._rate_changed('increase')
+
+    def on_throttle(self) -> float:
+        with self._lock:
+            now = monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._successes = 0
+            self._throttles += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            pause = min(self.max_cooldown, self.cooldown * 2 ** (self._throttles - 1))
+            self._paused_until = now + pause
+            self._tokens = 0.0
+            self._rate_changed('decrease')
+            return pause
+
+
+def _request(kw_list: list, geo: str, timeframe: str, pool: SessionPool) -> pd.DataFrame:
+    """Fetches the interest over time of kw_list for a single timeframe on a
+    session borrowed from the pool."""
+    pytrends = pool.acquire()
+    try:
+        pytrends.build_payload(kw_list=kw_list, cat=0, timeframe=timeframe, geo=geo, gprop='')
+        frame = pytrends.interest_over_time()
+    except Exception:
+        pool.release(pytrends, failed=True)
+        raise
+    pool.release(pytrends)
+    return frame
+
+
+def timed_fetch(fetch, limiter: TokenBucket, pool: SessionPool = None, **fields):
+    """Takes a token from the limiter and runs fetch(). If the limiter has
+    telemetry, one line is recorded for the request with the time waited
+    for the token, the latency, the HTTP status, the bytes received and the
+    given fields. Exceptions are recorded and raised again."""
+    waited = limiter.acquire()
+    started = monotonic()
+    status, error = 200, None
+    try:
+        return fetch()
+    except Exception as err:
+        status = getattr(getattr(err, 'response', None), 'status_code', None)
+        if status is None and isinstance(err, TooManyRequestsError):
+            status = 429
+        error = str(err)
+        raise
+    finally:
+        if limiter.telemetry is not None:
+            limiter.telemetry.record(wait=waited, latency=monotonic() - started, status=status,
+                                     bytes=pool.last_bytes() if pool is not None else None,
+                                     rate=limiter.rate, error=error, **fields)
+
+
+def fetch_windows(tasks: dict,
+                  limiter: TokenBucket,
+                  workers: int = 4,
+                  max_attempts: int = 4,
+                  verbose: bool = True,
+                  on_result=None,
+                  pool: SessionPool = None) -> dict:
+    """Runs every fetch in `tasks` ((keywords, timeframe) -> callable) on a
+    thread pool.
+
+    Each attempt first takes a token from the shared limiter, so the request
+    rate stays bounded however many fetches are in flight. Google's errors
+    and connection errors or timeouts are retried; keys that still fail
+    after max_attempts are left out of the returned dict. `pool` is
+    only used to report the bytes received to the telemetry.
+    """
+    def run(key):
+        keywords, timeframe = key
+        for attempt in range(1, max_attempts + 1):
+            try:
+                result = timed_fetch(tasks[key], limiter, pool, keywords=keywords,
+                                     timeframe=timeframe, attempt=attempt)
+            except ResponseError as err:
+                pause = limiter.on_throttle()
+                print(f'{key}: {err}')
+                print(f'Attempt {attempt} failed, all workers pause for {pause:.0f} seconds.')
+            except RequestException as err:
+                # Connection errors and timeouts are retried without slowing down
+                print(f'{key}: {err}')
+                print(f'Attempt {attempt} failed.')
             else:
-                print(f'Trying again in 60 seconds.')
-                sleep(60)  # Sleep for 60 seconds for normal consecutive errors
+                limiter.on_success()
+                if verbose:
+                    print(f'{key} ({limiter.requests_per_minute():.1f} requests/min)')
+                if on_result is not None:
+                    on_result(key, result)
+                return result
+        print(f'{key}: failed after {max_attempts} attempts, abort fetching.')
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {key: executor.submit(run, key) for key in tasks}
+        results = {key: future.result() for key, future in futures.items()}
+    return {key: result for key, result in results.items() if result is not None}
+
+
+def scale_daily_data(word: str, daily: list, monthly: pd.DataFrame) -> pd.DataFrame:
+    """Joins the month by month daily frames with the monthly series and
+    scales the daily data by the monthly weights so the data is comparable."""
+    daily = pd.concat(daily).drop(columns=['isPartial'])
+    complete = daily.join(monthly, lsuffix='_unscaled', rsuffix='_monthly')
 
-            # Set the last successful month to the previous one before the error occurred
-            if last_successful_month:
-                current = last_successful_month
-            continue
+    complete[f'{word}_monthly'] = complete[f'{word}_monthly'].ffill()  # fill NaN values
+    complete['scale'] = complete[f'{word}_monthly'] / 100
+    complete[word] = complete[f'{word}_unscaled'] * complete.scale
 
-        cache['last_successful_month'] = current  # Update the last successful month
-        last_successful_month = current  # Update last_successful_month for potential future errors
-        current = last_date_of_month + timedelta(days=1)
-        sleep(wait_time)  # don't go too fast or Google will send 429s
+    return complete
 
-    daily = pd.concat(results.values()).drop(columns=['isPartial'])
-    complete = daily.join(monthly, lsuffix='_unscaled', rsuffix='_monthly')
 
-    # Scale daily data by monthly weights so the data is comparable
-    complete[f'{word}_monthly'].ffill(inplace=True)  # fill NaN values
-    complete['scale'] = complete[f'{word}_monthly'] / 100
+def _monthly_factor(values: pd.Series, monthly: pd.Series) -> float:
+    """Ratio between the monthly series and the monthly means of a daily
+    window, using only the months the window covers entirely."""
+    months = values.index.to_period('M')
+    means = values.groupby(months).mean()
+    counts = values.groupby(months).size()
+    full = counts[counts == counts.index.days_in_month].index
+    if len(full) > 0:
+        means = means.loc[full]
+    weights = monthly.groupby(monthly.index.to_period('M')).first()
+    common = means.index.intersection(weights.index)
+    total = means.loc[common].sum()
+    return weights.loc[common].sum() / total if total > 0 else float('nan')
+
+
+def stitch_daily_data(word: str, daily: list, monthly: pd.DataFrame, stitch: str = 'overlap') -> pd.DataFrame:
+    """Combines long, overlapping daily windows into one series.
+
+    With stitch='overlap' every window is chained to the previous one by the
+    ratio of their sums over the shared days, and the whole chain is then
+    scaled once so that its monthly means match the monthly series. With
+    stitch='monthly' every window is scaled by the monthly series on its own,
+    like the month by month requests. Days shared by two windows are taken
+    from the earlier one. The columns are the same as scale_daily_data's,
+    `scale` being the factor applied to each window.
+    """
+    if stitch not in ('overlap', 'monthly'):
+        raise ValueError("stitch must be 'overlap' or 'monthly'")
+    weights = monthly[word]
+    chained, pieces, factors = None, [], []
+    first_factor = None
+    for frame in daily:
+        values = frame[word].astype(float)
+        monthly_factor = _monthly_factor(values, weights)
+        if first_factor is None:
+            first_factor = monthly_factor
+        if stitch == 'monthly':
+            factor = monthly_factor
+        elif chained is None:
+            factor = 1.0
+        else:
+            overlap = chained.index.intersection(values.index)
+            previous, current = chained.loc[overlap].sum(), values.loc[overlap].sum()
+            if previous > 0 and current > 0:
+                factor = previous / current
+            else:
+                # Nothing to chain on, go through the monthly series instead
+                factor = monthly_factor / first_factor
+        if chained is not None:
+            values = values.loc[values.index > chained.index[-1]]
+        pieces.append(values)
+        factors.append(pd.Series(factor, index=values.index))
+        chained = values * factor if chained is None else pd.concat([chained, values * factor])
+
+    scale = pd.concat(factors)
+    if stitch == 'overlap':
+        scale = scale * _monthly_factor(chained, weights)
+
+    complete = pd.concat(pieces).to_frame(word).join(monthly, lsuffix='_unscaled', rsuffix='_monthly')
+    complete[f'{word}_monthly'] = complete[f'{word}_monthly'].ffill()
+    complete['scale'] = scale
     complete[word] = complete[f'{word}_unscaled'] * complete.scale
 
     return complete
 
 
-import pickle
+def split_batch(frame: pd.DataFrame, word: str, anchor: str = None) -> pd.DataFrame:
+    """Extracts one keyword from a multi-keyword frame, renormalised so that
+    its own peak is 100 as if it had been requested alone. If anchor is
+    given it is kept, on the same scale, in an `_anchor` column."""
+    columns = [word, 'isPartial'] + ([anchor] if anchor is not None else [])
+    single = frame[columns].rename(columns={anchor: '_anchor'}) if anchor is not None else frame[columns].copy()
+    peak = single[word].max()
+    if peak > 0:
+        single[word] = single[word] * 100 / peak
+        if anchor is not None:
+            single['_anchor'] = single['_anchor'] * 100 / peak
+    return single
+
+
+def get_anchor_scale(monthly: pd.DataFrame) -> float:
+    """Factor putting a keyword's monthly scaled series (peak 100) onto the
+    common scale on which the anchor's average over the range is 100."""
+    anchor_mean = monthly['_anchor'].mean()
+    if anchor_mean == 0:
+        return float('nan')
+    return 100 / anchor_mean
+
+
+def get_timeframes(start_date: date, stop_date: date, window_days: int = None, overlap_days: int = 30):
+    """Returns the timeframe of the monthly request and the timeframes of the
+    daily requests: one per calendar month, or long overlapping windows if
+    window_days is set."""
+    if window_days is None:
+        windows = [(current, get_last_date_of_month(current.year, current.month))
+                   for current in get_month_starts(start_date, stop_date)]
+    else:
+        windows = get_daily_windows(start_date, stop_date, window_days, overlap_days)
+    return (convert_dates_to_timeframe(start_date, stop_date),
+            [convert_dates_to_timeframe(start, stop) for start, stop in windows])
+
+
+def save_window(store: FetchStore, group, geo: str, timeframe: str, frame: pd.DataFrame,
+                anchor: str = None, monthly: bool = False):
+    """Writes the frame returned for a group of keywords to the store, one
+    renormalised window per keyword when the request was batched."""
+    for word in group:
+        if len(group) == 1 and anchor is None:
+            store.put(word, geo, timeframe, frame)
+        else:
+            # The anchor is only needed to put the monthly series on the common scale
+            store.put(word, geo, timeframe, split_batch(frame, word, anchor if monthly else None))
+
+
+def fetch_into_store(words: list,
+                     monthly_timeframe: str,
+                     timeframes: list,
+                     store: FetchStore,
+                     geo: str,
+                     limiter: TokenBucket,
+                     workers: int = 4,
+                     verbose: bool = True,
+                     pool: SessionPool = None,
+                     batch_size: int = 1,
+                     anchor: str = None):
+    """Requests the monthly window and every daily window of the keywords
+    that is not in the store yet, batch_size keywords (plus the anchor) per
+    request, and writes each window to the store as soon as it arrives."""
+    if batch_size + (anchor is not None) > 5:
+        raise ValueError('Google Trends accepts at most 5 terms per request')
+    pool = SessionPool() if pool is None else pool
+    extra = [anchor] if anchor is not None else []
+    groups = [tuple(words[i:i + batch_size]) for i in range(0, len(words), batch_size)]
+
+    tasks = {}
+    for group in groups:
+        for timeframe in [monthly_timeframe] + timeframes:
+            if not all(store.has(word, geo, timeframe) for word in group):
+                tasks[(group, timeframe)] = partial(_request, list(group) + extra, geo, timeframe, pool)
+
+    def save(key, frame):
+        group, timeframe = key
+        save_window(store, group, geo, timeframe, frame, anchor, timeframe == monthly_timeframe)
+
+    fetch_windows(tasks, limiter, workers=workers, verbose=verbose, on_result=save, pool=pool)
+    if verbose:
+        print(f'{limiter.sent} requests sent, {limiter.requests_per_minute():.1f} requests/min')
+        print(f'Sessions: {pool.stats()}')
+
+
+def load_monthly(store: FetchStore, word: str, geo: str, monthly_timeframe: str):
+    """Returns the stored monthly series of a keyword and its anchor_scale
+    (None when it was not fetched together with an anchor)."""
+    monthly = store.get(word, geo, monthly_timeframe)
+    if monthly is None or '_anchor' not in monthly:
+        return monthly, None
+    return monthly.drop(columns=['_anchor']), get_anchor_scale(monthly)
+
+
+def assemble_daily_data(word: str, store: FetchStore, geo: str, monthly_timeframe: str, timeframes: list,
+                        window_days: int = None, stitch: str = 'overlap'):
+    """Scales the stored windows of a keyword into one daily series, or
+    returns None if its monthly series or all its daily windows are missing."""
+    monthly, anchor_scale = load_monthly(store, word, geo, monthly_timeframe)
+    daily = [frame for frame in (store.get(word, geo, timeframe) for timeframe in timeframes)
+             if frame is not None]
+    if monthly is None or not daily:
+        return None
+    if window_days is None:
+        complete = scale_daily_data(word, daily, monthly)
+    else:
+        complete = stitch_daily_data(word, daily, monthly, stitch)
+    if anchor_scale is not None:
+        complete['anchor_scale'] = anchor_scale
+        complete[f'{word}_common'] = complete[word] * complete['anchor_scale']
+    return complete
 
-# Function to save cache to file
-def save_cache(cache, filename='cache.pkl'):
-    with open(filename, 'wb') as file:
-        pickle.dump(cache, file)
 
-# Function to load cache from file
-def load_cache(filename='cache.pkl'):
+def drain_queue(queue: JobQueue,
+                store: FetchStore,
+                limiter: TokenBucket,
+                pool: SessionPool = None,
+                workers: int = 4,
+                batch_size: int = 1,
+                anchor: str = None,
+                verbose: bool = True,
+                stale_after: float = 3600.0):
+    """Fetches the jobs of the journal until none is pending.
+
+    Each of the `workers` threads claims the highest priority pending window
+    (with up to batch_size - 1 other keywords waiting for the same window),
+    requests it and writes it to the store before marking the jobs done.
+    Failed requests go back to the queue until their retry budget is spent.
+    Several processes can drain the same journal; jobs left in flight for
+    more than stale_after seconds by a dead worker are claimed again. A
+    heartbeat thread keeps the jobs of this process fresh meanwhile, even
+    while their requests wait for the limiter or a pause.
+    """
+    if batch_size + (anchor is not None) > 5:
+        raise ValueError('Google Trends accepts at most 5 terms per request')
+    pool = SessionPool() if pool is None else pool
+    extra = [anchor] if anchor is not None else []
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    requeued = queue.requeue_stale(stale_after)
+    if requeued:
+        print(f'{requeued} jobs left in flight by a stopped worker are pending again')
+
+    def work(thread: int):
+        while True:
+            jobs = queue.claim(f'{name}:{thread}', limit=batch_size)
+            if not jobs:
+                return
+            group = [job[0] for job in jobs]
+            _, geo, timeframe, resolution, attempts = jobs[0]
+            try:
+                frame = timed_fetch(partial(_request, group + extra, geo, timeframe, pool), limiter, pool,
+                                    keywords=group, timeframe=timeframe, attempt=attempts + 1)
+            except Exception as err:
+                if isinstance(err, ResponseError):
+                    pause = limiter.on_throttle()
+                    print(f'Workers pause for {pause:.0f} seconds.')
+                print(f'{group} {timeframe}: {err}')
+                queue.fail(jobs, str(err))
+                continue
+            limiter.on_success()
+            save_window(store, group, geo, timeframe, frame, anchor, resolution == 'monthly')
+            queue.complete(jobs)
+            if verbose:
+                print(f'{group} {timeframe} ({limiter.requests_per_minute():.1f} requests/min)')
+
+    def heartbeat():
+        while not stopped.wait(min(stale_after / 4, 60.0)):
+            queue.heartbeat(name)
+
+    stopped = threading.Event()
+    beating = threading.Thread(target=heartbeat, daemon=True)
+    beating.start()
     try:
-        with open(filename, 'rb') as file:
-            return pickle.load(file)
-    except FileNotFoundError:
-        return {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(work, range(workers)))
+    finally:
+        stopped.set()
+        beating.join()
+    if verbose:
+        print(f'Jobs: {queue.counts()}')
+        print(f'Sessions: {pool.stats()}')
+
+
+def get_daily_data_many(words: list,
+                        start_year: int,
+                        start_mon: int,
+                        stop_year: int,
+                        stop_mon: int,
+                        geo: str = 'US',
+                        verbose: bool = True,
+                        wait_time: float = 5.0,
+                        store: FetchStore = None,
+                        workers: int = 4,
+                        limiter: TokenBucket = None,
+                        pool: SessionPool = None,
+                        batch_size: int = 1,
+                        anchor: str = None,
+                        window_days: int = None,
+                        overlap_days: int = 30,
+                        stitch: str = 'overlap') -> dict:
+    """Fetches the scaled daily data of several keywords at once.
+
+    The monthly and month by month daily requests of every keyword are
+    queued together and drained by `workers` threads sharing one token
+    bucket that allows on average one request every wait_time seconds.
+    Every window is written to `store` as soon as it is fetched and windows
+    already in the store are not requested again (an in-memory store is used
+    if none is given). Keywords with missing windows are scaled with
+    whatever was fetched.
+
+    With batch_size > 1 up to batch_size keywords plus the `anchor` term
+    share every payload (Google Trends accepts five terms per request). Each
+    keyword is split out of the batch and renormalised to its own peak, so
+    the monthly/daily scaling is the same as for single keyword requests,
+    and the anchor puts the keywords on a common scale: `{word}_common` is
+    `word` times `anchor_scale`, in units where the anchor averages 100.
+    The anchor should be about as popular as the keywords, since Trends
+    rounds every value of a payload to an integer share of its peak.
+
+    With window_days set, the daily data is requested in windows of that many
+    days (at most 269 for daily resolution) overlapping by overlap_days,
+    instead of one calendar month per request, and the windows are combined
+    by stitch_daily_data. 2004-2011 then takes 13 daily requests per keyword
+    instead of 96.
+    """
+    start_date = date(start_year, start_mon, 1)
+    stop_date = get_last_date_of_month(stop_year, stop_mon)
+    store = FetchStore(':memory:') if store is None else store
+    if limiter is None:
+        limiter = TokenBucket(rate=1 / wait_time, burst=workers)
+    words = [word for word in words if word != anchor]
+
+    monthly_timeframe, timeframes = get_timeframes(start_date, stop_date, window_days, overlap_days)
+    fetch_into_store(words, monthly_timeframe, timeframes, store, geo, limiter, workers=workers,
+                     verbose=verbose, pool=pool, batch_size=batch_size, anchor=anchor)
+
+    results = {}
+    for word in words:
+        complete = assemble_daily_data(word, store, geo, monthly_timeframe, timeframes, window_days, stitch)
+        if complete is not None:
+            results[word] = complete
+    return results
+
 
-def merge_csv_files(keywords):
-    all_data = pd.DataFrame()
+def get_daily_data(word: str,
+                   start_year: int,
+                   start_mon: int,
+                   stop_year: int,
+                   stop_mon: int,
+                   geo: str = 'US',
+                   verbose: bool = True,
+                   wait_time: float = 5.0,
+                   store: FetchStore = None,
+                   workers: int = 4) -> pd.DataFrame:
+    """Single keyword version of get_daily_data_many."""
+    results = get_daily_data_many([word], start_year, start_mon, stop_year, stop_mon, geo=geo,
+                                  verbose=verbose, wait_time=wait_time, store=store,
+                                  workers=workers)
+    return results.get(word, pd.DataFrame())
+
+
+def compare_daily_data(reference: pd.DataFrame, candidate: pd.DataFrame, word: str) -> dict:
+    """Agreement between two scaled daily series of the same keyword, on the
+    levels and on the daily log differences the FEARS index is built from."""
+    both = pd.concat([reference[word], candidate[word]], axis=1, keys=['reference', 'candidate']).dropna()
+    log_diff = np.log1p(both).diff().dropna()
+    return {
+        'keyword': word,
+        'days': len(both),
+        'level_corr': both['reference'].corr(both['candidate']),
+        'log_diff_corr': log_diff['reference'].corr(log_diff['candidate']),
+        'log_diff_mae': (log_diff['reference'] - log_diff['candidate']).abs().mean(),
+    }
+
+
+def validate_daily_windows(words: list,
+                           start_year: int,
+                           start_mon: int,
+                           stop_year: int,
+                           stop_mon: int,
+                           window_days: int = 269,
+                           overlap_days: int = 30,
+                           stitch: str = 'overlap',
+                           **kwargs) -> pd.DataFrame:
+    """Fetches the keywords both month by month and with long stitched
+    windows and returns one row of compare_daily_data per keyword. Both runs
+    share `store`, so the monthly series is requested once."""
+    store = kwargs.pop('store', None) or FetchStore(':memory:')
+    months = get_daily_data_many(words, start_year, start_mon, stop_year, stop_mon, store=store, **kwargs)
+    stitched = get_daily_data_many(words, start_year, start_mon, stop_year, stop_mon, store=store,
+                                   window_days=window_days, overlap_days=overlap_days, stitch=stitch,
+                                   **kwargs)
+    rows = [compare_daily_data(months[word], stitched[word], word)
+            for word in words if word in months and word in stitched]
+    return pd.DataFrame(rows)
+
+
+def extend_daily_data_many(existing: dict,
+                           stop: date = None,
+                           geo: str = 'US',
+                           verbose: bool = True,
+                           wait_time: float = 5.0,
+                           store: FetchStore = None,
+                           workers: int = 4,
+                           limiter: TokenBucket = None,
+                           pool: SessionPool = None,
+                           batch_size: int = 1,
+                           anchor: str = None,
+                           window_days: int = 269,
+                           overlap_days: int = 30,
+                           tolerance: float = 0.02) -> dict:
+    """Extends already scaled daily series (keyword -> frame as saved in
+    data_{keyword}.csv) up to `stop` (yesterday by default).
+
+    Only the days after the last stored date are requested, in windows of up
+    to window_days days starting overlap_days before that date, plus one
+    monthly series over the extended range to scale them. The scaled tail is
+    compared with the stored series over the overlap and is re-anchored by
+    the ratio of the two only when they differ by more than `tolerance`
+    (which happens when the new months hold a new peak, changing the monthly
+    normalisation). Returns the extended frames.
+    """
+    stop = date.today() - timedelta(days=1) if stop is None else stop
+    store = FetchStore(':memory:') if store is None else store
+    if limiter is None:
+        limiter = TokenBucket(rate=1 / wait_time, burst=workers)
+
+    # Keywords stored up to the same date share their requests
+    by_range = {}
+    for word, frame in existing.items():
+        first, last = frame.index[0].date(), frame.index[-1].date()
+        if word != anchor and last < stop:
+            by_range.setdefault((first, last), []).append(word)
+
+    results = dict(existing)
+    for (first, last), words in by_range.items():
+        tail_start = max(first, last - timedelta(days=overlap_days - 1))
+        timeframes = [convert_dates_to_timeframe(start, end)
+                      for start, end in get_daily_windows(tail_start, stop, window_days, overlap_days)]
+        monthly_timeframe = convert_dates_to_timeframe(date(first.year, first.month, 1), stop)
+        fetch_into_store(words, monthly_timeframe, timeframes, store, geo, limiter, workers=workers,
+                         verbose=verbose, pool=pool, batch_size=batch_size, anchor=anchor)
+
+        for word in words:
+            monthly, _ = load_monthly(store, word, geo, monthly_timeframe)
+            daily = [frame for frame in (store.get(word, geo, timeframe) for timeframe in timeframes)
+                     if frame is not None]
+            if monthly is None or not daily:
+                print(f'Could not extend {word}, its new windows are missing.')
+                continue
+            stored = existing[word]
+            tail = stitch_daily_data(word, daily, monthly, 'overlap')
+
+            overlap = stored.index.intersection(tail.index)
+            tail_sum = tail.loc[overlap, word].sum()
+            ratio = stored.loc[overlap, word].sum() / tail_sum if tail_sum > 0 else 1.0
+            if abs(ratio - 1) > tolerance:
+                if verbose:
+                    print(f'{word}: re-anchoring the new days by {ratio:.3f} over the overlap')
+                tail['scale'] = tail['scale'] * ratio
+                tail[word] = tail[word] * ratio
+
+            new = tail.loc[tail.index > stored.index[-1]].copy()
+            if 'anchor_scale' in stored:
+                # Keep the stored factor so the common scale does not jump
+                new['anchor_scale'] = stored['anchor_scale'].iloc[-1]
+                new[f'{word}_common'] = new[word] * new['anchor_scale']
+            results[word] = pd.concat([stored, new.reindex(columns=stored.columns)])
+    return results
+
+
+def extend_panel(panel: PanelStore, keywords: list = None, stop: date = None, **kwargs) -> list:
+    """Extends the keywords of the panel (all of them by default) up to
+    `stop` with extend_daily_data_many, adding dates to the panel when
+    needed. Returns the extended keywords."""
+    keywords = panel.keywords if keywords is None else [keyword for keyword in keywords if keyword in panel]
+    existing = {}
     for keyword in keywords:
-        file_path = f'data_{keyword}.csv'  # Adjusted to match your file naming convention
-        if os.path.exists(file_path):
-            keyword_data = pd.read_csv(file_path, index_col=0)  # Assuming first column is the date/index
-            all_data = pd.concat([all_data, keyword_data], axis=1)
-        else:
-            print(f"File not found for keyword: {keyword}")
-    return all_data
+        series = panel.series(keyword).dropna()
+        if not series.empty:
+            existing[keyword] = series.to_frame(keyword)
+
+    extended = extend_daily_data_many(existing, stop=stop, **kwargs)
+    updated = [keyword for keyword, frame in extended.items() if len(frame) > len(existing[keyword])]
+    if updated:
+        panel.extend_dates(max(extended[keyword].index[-1] for keyword in updated))
+    for keyword in updated:
+        panel.put(keyword, extended[keyword][keyword])
+    print(f'{len(updated)} of {len(existing)} keywords extended')
+    return updated
+
 
 if __name__ == "__main__":
     # Adjust the parameters accordingly for your research time frame
@@ -158,51 +746,93 @@ if __name__ == "__main__":
     start_month = 1
     stop_year = 2011
     stop_month = 12
+    geo = 'US'
+
+    # Number of requests kept in flight
+    workers = 4
+
+    # Shared anchor term: when set, 4 keywords and the anchor share each request
+    anchor = None
+    keywords_per_request = 4 if anchor is not None else 1
+
+    # Days per daily request: None requests one calendar month at a time,
+    # 269 uses the longest windows with daily resolution, stitched together
+    # through overlap_days shared days ('overlap') or the monthly series ('monthly')
+    window_days = None
+    overlap_days = 30
+    stitch = 'overlap'
+
+    # Optional csv with a 'Keywords' column (e.g. past top-K keywords) fetched first
+    priority_keywords_path = None
 
     # List of keywords to process
     final_keywords_df = pd.read_csv('/Users/riccardodjordjevic/Desktop/Excel/final_keywords.csv')
     keywords = final_keywords_df['Keywords'].tolist()
 
+    # Optional report of an earlier run (python keyword_quality.py): keywords
+    # that cannot reach min_nonzero non-zero days even with the days added
+    # since then are not fetched again
+    quality_report_path = None
+    min_nonzero = 1000
+
+    # One limiter and one pool of sessions for the whole run, so the backoff
+    # carries over between requests and sessions are reused across keywords.
+    # The limiter starts at one request every 10 seconds and speeds up until
+    # Google answers with 429s; every request is logged to fetch_telemetry.jsonl
+    telemetry = Telemetry('fetch_telemetry.jsonl')
+    limiter = AIMDBucket(rate=1 / 10.0, burst=workers, ceiling=1.0, telemetry=telemetry)
+    pool = SessionPool()
+
+    # Every fetched window is kept here, a restart only requests what is missing
+    store = FetchStore('fetch_store.sqlite')
+
+    # The scaled series of every keyword end up in one date x keyword panel,
+    # which is what the FEARS scripts read
+    start_date = date(start_year, start_month, 1)
+    stop_date = get_last_date_of_month(stop_year, stop_month)
+    panel_path = 'panel'
+    if os.path.exists(os.path.join(panel_path, 'meta.json')):
+        panel = PanelStore(panel_path)
+    else:
+        panel = PanelStore(panel_path, dates=pd.date_range(start_date, stop_date, name='date'))
+
+    # Set to True to only append the days after the last date of the keywords
+    # in the panel, up to yesterday, instead of fetching the whole range
+    extend = False
+    if quality_report_path:
+        report = pd.read_parquet(quality_report_path)
+        refresh_stop = date.today() - timedelta(days=1) if extend else stop_date
+        new_days = max((pd.Timestamp(refresh_stop) - report['last_date'].max()).days, 0)
+        skipped = set(hopeless_keywords(report, min_nonzero, new_days))
+        keywords = [word for word in keywords if word not in skipped]
+        print(f'Skipping {len(skipped)} keywords with too few non-zero days in {quality_report_path}')
+    if extend:
+        extend_panel(panel, keywords, store=store, workers=workers, limiter=limiter, pool=pool,
+                     batch_size=keywords_per_request, anchor=anchor, overlap_days=overlap_days)
+        raise SystemExit
+
+    # Journal of the windows still to fetch. Running this script again (or in
+    # several processes at once) picks up the pending windows where it stopped
+    queue = JobQueue('fetch_jobs.sqlite')
+    monthly_timeframe, timeframes = get_timeframes(start_date, stop_date, window_days, overlap_days)
+    priorities = load_priorities(priority_keywords_path) if priority_keywords_path else None
+    queue.add_keywords([word for word in keywords if word != anchor], geo, monthly_timeframe, timeframes,
+                       priorities=priorities, store=store)
+
+    drain_queue(queue, store, limiter, pool, workers=workers, batch_size=keywords_per_request, anchor=anchor)
+
     gathered_keywords_count = 0
     for word in keywords:
-        # Load existing cache or create an empty one for each keyword
-        data_cache = load_cache()
-
-        # Fetch the data for the current keyword using cache
-        data = get_daily_data(word, start_year, start_month, stop_year, stop_month, wait_time=10.0,
-                              cache=data_cache)
-
-        # Check if the data is gathered for the full timeframe before saving and deleting cache
-        last_date_fetched = data.index[-1].date()
-        stop_date = get_last_date_of_month(stop_year, stop_month)
-        if last_date_fetched == stop_date:
-            # Save the 'data' DataFrame as a CSV file
-            data.to_csv(f'data_{word}.csv')
-            print(f'{word} data saved as csv')
+        data = assemble_daily_data(word, store, geo, monthly_timeframe, timeframes, window_days, stitch)
+        # Check if the data is gathered for the full timeframe before saving
+        if data is not None and all(store.has(word, geo, timeframe) for timeframe in timeframes):
+            panel.put(word, data[word])
             gathered_keywords_count += 1
-
-            progress_percentage = (gathered_keywords_count / len(keywords)) * 100
-
-            # Print the progress with the percentage
-            print(f"{gathered_keywords_count} keywords gathered out of {len(keywords)} total keywords "
-                  f"({progress_percentage:.2f}% complete)")
-
-            # Delete the cache
-            data_cache.clear()
-            save_cache(data_cache)
         else:
-            print(f"Data gathering incomplete for {word}. Not saving CSV or deleting cache.")
-
-        # Display the fetched data
-        print(data.head())
-
-        # Sleep for 60 seconds before processing the next keyword
-        if word != keywords[-1]:  # Skip sleep on the last iteration
-            print(f"Sleeping for 60 seconds before processing the next keyword...")
-            sleep(60)
-
-    merged_data = merge_csv_files(keywords)
+            print(f"Data gathering incomplete for {word}, its failed windows stay in the journal.")
 
-    # Saving the merged data into a new CSV file
-    merged_data.to_csv('merged_interest_over_time.csv')
-    print("Merged data saved as 'merged_interest_over_time.csv'")
+    progress_percentage = (gathered_keywords_count / len(keywords)) * 100
+    print(f"{gathered_keywords_count} keywords gathered out of {len(keywords)} total keywords "
+          f"({progress_percentage:.2f}% complete)")
+    print(f"Jobs: {queue.counts()}")
+    print(f"Panel of {len(panel.keywords)} keywords saved in '{panel_path}'")
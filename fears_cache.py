@@ -0,0 +1,92 @@
+"""On-disk cache of the stages of the FEARS pipeline (fears_engine.py).
+
+Every stage output is pickled under a key hashing the stage name, its
+parameters and the keys of the stages it reads, and the raw inputs (the
+search volume files and the S&P 500 file) are hashed by content. Changing
+a parameter therefore only recomputes the stages downstream of it: a new K
+or smoothing window reuses the ingested, transformed, deseasonalized and
+ranked data, while an edited csv file invalidates everything.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from time import perf_counter
+
+# Bump when a stage computes something different for the same inputs
+CACHE_VERSION = 2
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def folder_digest(folder_path: str, prefix: str = '', suffix: str = '') -> str:
+    """Digest of the names and contents of the files of a folder whose
+    names start with `prefix` and end with `suffix`."""
+    digest = hashlib.blake2b(digest_size=16)
+    for file in sorted(os.listdir(folder_path)):
+        if file.startswith(prefix) and file.endswith(suffix):
+            digest.update(file.encode('utf-8'))
+            digest.update(file_digest(os.path.join(folder_path, file)).encode('ascii'))
+    return digest.hexdigest()
+
+
+class StageCache:
+    """Pickled stage outputs stored as {stage}-{key}.pkl in the folder
+    `path`. With path=None nothing is stored and every stage is computed.
+    `timings` holds the seconds each stage took to load or compute."""
+
+    def __init__(self, path: str = 'fears_cache'):
+        self.path = path
+        self.hits = []
+        self.misses = []
+        self.timings = {}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, stage: str, *inputs) -> str:
+        """Key of a stage from its parameters and upstream keys, which must
+        have a stable repr (numbers, strings, tuples)."""
+        if self.path is None:
+            return ''
+        return hashlib.blake2b(repr((CACHE_VERSION, stage) + inputs).encode('utf-8'), digest_size=16).hexdigest()
+
+    def digest(self, path: str, **kwargs) -> str:
+        """Content digest of an input file or folder ('' when not caching)."""
+        if self.path is None:
+            return ''
+        return folder_digest(path, **kwargs) if os.path.isdir(path) else file_digest(path)
+
+    def run(self, stage: str, key: str, compute):
+        """Loads the output stored under `key`, or computes and stores it."""
+        started = perf_counter()
+        file_path = None if self.path is None else os.path.join(self.path, f'{stage}-{key}.pkl')
+        if file_path is not None and os.path.exists(file_path):
+            with open(file_path, 'rb') as file:
+                value = pickle.load(file)
+            self.hits.append(stage)
+        else:
+            value = compute()
+            if file_path is not None:
+                # A temporary file of its own, as several processes may store
+                # the same stage at once (fears_sweep.py)
+                handle, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+                with os.fdopen(handle, 'wb') as file:
+                    pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, file_path)
+            self.misses.append(stage)
+        self.timings[stage] = perf_counter() - started
+        return value
+
+    def clear(self):
+        """Deletes every stored stage output."""
+        if self.path is None:
+            return
+        for file in os.listdir(self.path):
+            if file.endswith('.pkl'):
+                os.remove(os.path.join(self.path, file))
@@ -0,0 +1,130 @@
+"""Out-of-core FEARS pipeline over a panel too large for memory.
+
+compute_fears holds the volumes, the transformed volumes, the residuals and
+the merged frame of all the keywords at once. The transform, winsorizing,
+deseasonalizing and t-statistic screening of a keyword do not depend on the
+other keywords, so compute_fears_chunked runs them on chunks of keywords
+read from the memory-mapped panel (panel_store.py), with as many keywords
+per chunk as fit in `memory_budget` megabytes:
+
+1. the quality report (keyword_quality.py) is computed one panel row at a
+   time and gives the keywords passing min_nonzero;
+2. every chunk is transformed, deseasonalized and ranked in every window,
+   and only the k smallest t-statistics of every window are kept across
+   chunks;
+3. the residuals of the keywords selected in any window are computed again,
+   and only those are assembled into the index.
+
+The index is the same as compute_fears', except that the keyword columns
+are only kept for the selected keywords (the others are empty). The
+walk-forward index is not computed in chunks: its residuals are updated
+one day at a time for all the keywords (fears_online.causal_residuals).
+
+    python fears_engine.py --panel panel --sp500 SP500.xlsx --memory-budget 500
+"""
+import numpy as np
+import pandas as pd
+from fears_engine import build_index
+from fears_io import read_table
+from fears_screening import PrefixSums
+from fears_transforms import deseasonalize, log_difference, winsorize
+from fears_windows import legacy_windows
+from keyword_quality import panel_quality, qualifying_keywords
+from panel_store import PanelStore
+
+# Days x keyword arrays alive at once while a chunk is processed (volumes,
+# log differences, sorted block, residuals and the six cumulative sums)
+COPIES_PER_KEYWORD = 12
+# Windows whose t-statistics are computed at once
+WINDOW_BLOCK = 256
+
+
+def chunk_size(days: int, memory_budget: float, itemsize: int = 8) -> int:
+    """Keywords per chunk so that a chunk of `days` days fits in
+    memory_budget megabytes."""
+    return max(int(memory_budget * 2 ** 20 // (COPIES_PER_KEYWORD * days * itemsize)), 1)
+
+
+def chunk_residuals(panel: PanelStore, rows, merged_rows: np.ndarray, limits=(0.025, 0.025),
+                    epsilon: float = 1e-10, dtype='float64') -> np.ndarray:
+    """(merged days x keywords) residuals of the panel rows `rows`, the
+    same as those of fears_engine.deseasonalize, on the days merged_rows."""
+    values = np.array(panel.matrix()[rows], dtype=dtype).T
+    log_diff = winsorize(log_difference(values, epsilon, dtype), limits)
+    del values
+    return deseasonalize(log_diff, panel.dates)[merged_rows]
+
+
+def merge_smallest(best: np.ndarray, best_t: np.ndarray, candidates: np.ndarray, candidates_t: np.ndarray,
+                   k: int):
+    """k smallest of two sets of (windows x n) keyword indices and their
+    t-statistics, ties in keyword order as fears_screening.smallest."""
+    indices = np.concatenate([best, candidates], axis=1)
+    t_stats = np.concatenate([best_t, candidates_t], axis=1)
+    order = np.lexsort((indices, t_stats), axis=1)[:, :k]
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(t_stats, order, axis=1)
+
+
+def compute_fears_chunked(sp500_path: str, panel_path: str, ks=(25, 30, 35), start: str = '2004-01-01',
+                          end: str = '2011-12-31', min_nonzero: int = 1000, limits=(0.025, 0.025),
+                          memory_budget: float = 500, dtype='float64', schedule=legacy_windows,
+                          smoothing: int = 10, cache_dir: str = None, verbose: bool = True) -> dict:
+    """{K: index DataFrame} of compute_fears, computed on chunks of
+    keywords of the panel within memory_budget megabytes. An Excel S&P 500
+    file is converted once to a binary copy in cache_dir, if given."""
+    panel = PanelStore(panel_path)
+    report = panel_quality(panel)
+    position = {keyword: row for row, keyword in enumerate(panel.keywords)}
+    keywords = qualifying_keywords(report, min_nonzero)
+    rows = np.array([position[keyword] for keyword in keywords], dtype=int)
+    if verbose:
+        print(f'{len(keywords)} of {len(report)} keywords have at least {min_nonzero} non-zero observations')
+
+    sp = read_table(sp500_path, cache_dir)
+    sp.set_index(sp.columns[0], inplace=True)
+    sp.index = pd.to_datetime(sp.index)
+    filtered_sp = sp.loc[pd.to_datetime(start):pd.to_datetime(end)]
+    merged_rows = np.flatnonzero(panel.dates.isin(filtered_sp.index))
+    dates = pd.Series(panel.dates[merged_rows])
+    returns = filtered_sp['return'].reindex(dates).to_numpy(dtype=float)
+
+    windows = schedule(dates)
+    if verbose:
+        print(windows)
+    starts, ends = windows['start'].to_numpy(), windows['end'].to_numpy()
+    # k smallest t-statistics of every window so far; the placeholders sort
+    # after every keyword
+    k = max(ks)
+    best = np.full((len(windows), k), np.iinfo(int).max)
+    best_t = np.full((len(windows), k), np.inf)
+    size = chunk_size(len(panel.dates), memory_budget, np.dtype(dtype).itemsize)
+    for chunk in range(0, len(rows), size):
+        chunk_rows = rows[chunk:chunk + size]
+        sums = PrefixSums(chunk_residuals(panel, chunk_rows, merged_rows, limits, dtype=dtype), returns)
+        for block in range(0, len(windows), WINDOW_BLOCK):
+            ranked = slice(block, block + WINDOW_BLOCK)
+            t_stats = sums.t_stats(starts[ranked], ends[ranked])
+            t_stats[np.isnan(t_stats)] = np.inf
+            candidates = np.broadcast_to(np.arange(chunk, chunk + len(chunk_rows)), t_stats.shape)
+            best[ranked], best_t[ranked] = merge_smallest(best[ranked], best_t[ranked], candidates, t_stats, k)
+        del sums
+        if verbose:
+            print(f'Ranked keywords {chunk + 1}-{chunk + len(chunk_rows)} of {len(rows)}')
+    best = best[:, :min(k, len(rows))]
+
+    # Only the keywords selected in some window make it into the index
+    selected = np.unique(best)
+    mrdf = pd.DataFrame(chunk_residuals(panel, rows[selected], merged_rows, limits, dtype=dtype),
+                        columns=[keywords[i] for i in selected])
+    mrdf.insert(0, 'dates', dates)
+    column = np.searchsorted(selected, best)
+
+    indices = {}
+    for k in ks:
+        if verbose:
+            for n, window in enumerate(windows.index):
+                print(f'{k}_smallest_{window}: {[keywords[i] for i in best[n, :k]]}')
+        mask = np.zeros((len(windows), len(selected)), dtype=bool)
+        np.put_along_axis(mask, column[:, :k], True, axis=1)
+        indices[k] = build_index(mrdf, mrdf.columns[1:].tolist(), mask, k, windows, smoothing)
+    return indices
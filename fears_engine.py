@@ -0,0 +1,434 @@
+"""FEARS index engine shared by FEARS_Stat25.py, FEARS_Stat30.py and FEARS_Stat35.py.
+
+The three scripts only differ in the number K of keywords averaged into the
+index, yet each of them used to read the search volumes, winsorize,
+deseasonalize and run all the rolling regressions again. compute_fears runs
+these stages once and builds the index of every requested K from the same
+ranking of the keywords:
+
+    python fears_engine.py --folder /path/to/csv --sp500 /path/to/SP500.xlsx --k 25 30 35
+
+writes merged_dataframe_with_first_column{K}.parquet for every K, the same
+tables the three scripts write (and .xlsx copies with --excel).
+
+Nothing is plotted unless asked (--plot), so the engine can run unattended,
+e.g. from cron, and matplotlib is only imported by plot_fears. --timing
+prints the import, startup and stage times.
+"""
+from time import perf_counter, process_time
+_import_started = perf_counter()
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from keyword_quality import panel_quality, quality_report, qualifying_keywords
+from panel_store import PanelStore
+from smoothing import MovingAverage
+from fears_cache import StageCache
+from fears_io import read_table, write_table
+from fears_online import causal_residuals
+from fears_screening import PrefixSums, rank_windows, smallest
+from fears_transforms import deseasonalize as seasonal_residuals, transform
+from fears_windows import calendar_windows, legacy_windows, periodic_windows
+
+# Seconds spent importing the modules above
+IMPORT_SECONDS = perf_counter() - _import_started
+
+
+def read_scaled_column(file_path: str) -> pd.Series:
+    """Scaled search volume (6th column) of one data_{keyword}.csv file,
+    indexed by its date strings. Only these two columns are parsed. Returns
+    None for files with fewer than 6 columns."""
+    with open(file_path, newline='', encoding='utf-8') as file:
+        names = next(csv.reader(file), [])
+    if len(names) < 6:
+        return None
+    df = pd.read_csv(file_path, usecols=[0, 5], dtype={names[0]: str, names[5]: 'float64'})
+    return pd.Series(df.iloc[:, 1].to_numpy(), index=df.iloc[:, 0].to_numpy())
+
+
+def read_csv_columns(folder_path: str, workers: int = None) -> dict:
+    """{keyword: scaled search volume} of every data_{keyword}.csv of the
+    folder, read by a pool of `workers` processes (one per core by default)."""
+    files = sorted(file for file in os.listdir(folder_path) if file.startswith('data_') and file.endswith('.csv'))
+    paths = [os.path.join(folder_path, file) for file in files]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            columns = list(executor.map(read_scaled_column, paths, chunksize=max(len(paths) // (4 * workers), 1)))
+    else:
+        columns = [read_scaled_column(path) for path in paths]
+
+    return {file[len('data_'):-len('.csv')]: column for file, column in zip(files, columns) if column is not None}
+
+
+def union_dates(columns) -> pd.Index:
+    """Dates (as in the files) of any of the `columns`."""
+    dates = [column.index.to_numpy(dtype=str) for column in columns]
+    return pd.Index(np.unique(np.concatenate(dates)) if dates else [], dtype=object)
+
+
+def columns_frame(columns: dict, dates: pd.Index = None) -> pd.DataFrame:
+    """One column per keyword of `columns`, aligned on their dates (all of
+    `dates` when given), with the dates as first column ('Dates'). Files
+    covering different date ranges line up and missing days are NaN."""
+    dates = union_dates(columns.values()) if dates is None else dates
+    if len(dates) == 0:
+        return pd.DataFrame({'Dates': []})
+    filtered_df = pd.concat(columns, axis=1).reindex(dates) if columns else pd.DataFrame(index=dates)
+    # The dates are parsed once, for the union of the dates of all the files
+    filtered_df.index = pd.to_datetime(filtered_df.index)
+    filtered_df = filtered_df.sort_index()
+    filtered_df.insert(0, 'Dates', filtered_df.index.strftime('%Y-%m-%d'))
+    return filtered_df.reset_index(drop=True)
+
+
+def load_panel(panel_path: str, keywords: list = None) -> pd.DataFrame:
+    """Same layout as columns_frame, read from a PanelStore folder (only
+    the `keywords` columns when given)."""
+    panel = PanelStore(panel_path)
+    filtered_df = panel.to_frame(keywords).reset_index(drop=True)
+    filtered_df.insert(0, 'Dates', panel.dates.strftime('%Y-%m-%d'))
+    return filtered_df
+
+
+def load_volumes(folder_path: str = None, panel_path: str = None, min_nonzero: int = 0, workers: int = None):
+    """(volumes, quality report) of the keywords of the csv folder or the
+    panel. The report (keyword_quality.py) is computed from every series as
+    it is read, and only the keywords with at least min_nonzero non-zero
+    days (missing days counting as non-zero) make it into the volumes,
+    which keep the dates of all of them."""
+    if panel_path:
+        report = panel_quality(PanelStore(panel_path))
+        return load_panel(panel_path, qualifying_keywords(report, min_nonzero)), report
+    columns = read_csv_columns(folder_path, workers)
+    dates = union_dates(columns.values())
+    report = quality_report(columns, len(dates))
+    kept = {keyword: columns.pop(keyword) for keyword in qualifying_keywords(report, min_nonzero)}
+    return columns_frame(kept, dates), report
+
+
+def deseasonalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Residuals of every column regressed on weekday and month dummies of
+    the dates (first column), divided by their standard deviation. Missing
+    values are left out of the regressions."""
+    residuals = seasonal_residuals(df.iloc[:, 1:].to_numpy(), pd.to_datetime(df.iloc[:, 0]))
+    residuals_df = pd.DataFrame(residuals, index=df.index, columns=df.columns[1:], copy=False)
+    residuals_df.insert(0, 'dates', df.iloc[:, 0])
+    return residuals_df
+
+
+def merge_returns(residuals_df: pd.DataFrame, sp500_path: str, start: str = '2004-01-01',
+                  end: str = '2011-12-31', cache_dir: str = None) -> pd.DataFrame:
+    """Joins the residuals with the S&P 500 file (dates in the first column,
+    a 'return' column) on the trading days between start and end. An Excel
+    file is converted once to a binary copy in cache_dir, if given."""
+    sp = read_table(sp500_path, cache_dir)
+    sp.set_index(sp.columns[0], inplace=True)
+    sp.index = pd.to_datetime(sp.index)
+    filtered_sp = sp.loc[pd.to_datetime(start):pd.to_datetime(end)]
+
+    residuals_df = residuals_df.copy()
+    residuals_df['dates'] = pd.to_datetime(residuals_df['dates'])
+    return pd.merge(residuals_df, filtered_sp, left_on='dates', right_index=True, how='inner')
+
+
+def causal_mrdf(volumes_df: pd.DataFrame, sp500_path: str, start: str = '2004-01-01', end: str = '2011-12-31',
+                limits=(0.025, 0.025), min_history: int = 130, cache_dir: str = None) -> pd.DataFrame:
+    """mrdf of the walk-forward index, with no look-ahead: the volumes up to
+    the first ranking (after min_history trading days) are winsorized and
+    deseasonalized on themselves, and every later day only with the days up
+    to it (fears_online.causal_residuals)."""
+    dates = pd.to_datetime(volumes_df.iloc[:, 0])
+    trading_dates = merge_returns(pd.DataFrame({'dates': dates}), sp500_path, start, end, cache_dir)['dates']
+    if len(trading_dates) <= min_history:
+        raise ValueError(f'{len(trading_dates)} trading days leave nothing after the first {min_history}')
+    warm_up = int(dates.searchsorted(trading_dates.iloc[min_history - 1], side='right'))
+    return merge_returns(causal_residuals(volumes_df, warm_up, limits), sp500_path, start, end, cache_dir)
+
+
+def rank_keywords(mrdf: pd.DataFrame, keywords: list, windows: pd.DataFrame = None,
+                  sums: PrefixSums = None) -> pd.DataFrame:
+    """t-statistic of every keyword in the regression of 'return' on it, for
+    the estimation sample of every window (fears_windows, the 15 expanding
+    samples of the original scripts by default). `sums` can be passed to
+    share them between schedules."""
+    if windows is None:
+        windows = legacy_windows(mrdf['dates'])
+    if sums is None:
+        sums = PrefixSums(mrdf[keywords].to_numpy(), mrdf['return'].to_numpy())
+    t_stats = sums.t_stats(windows['start'].to_numpy(), windows['end'].to_numpy())
+    return pd.DataFrame(t_stats.T, index=keywords, columns=windows.index)
+
+
+def select_keywords(average_t_stats_df: pd.DataFrame, ks: list) -> dict:
+    """{K: {n: keywords}} with the K most negative t-statistics of every
+    regression n. The keywords are ranked once for the largest K, and every
+    smaller K takes the head of that ranking."""
+    keywords = average_t_stats_df.index.to_numpy()
+    ranking = smallest(average_t_stats_df.to_numpy(dtype=float).T, max(ks))
+    return {k: {n: keywords[ranking[i, :k]].tolist() for i, n in enumerate(average_t_stats_df.columns)}
+            for k in ks}
+
+
+def selection_mask(keywords: list, smallest_lists: dict, window_ids) -> np.ndarray:
+    """(windows x keywords) boolean mask of the keywords selected in every
+    window of window_ids."""
+    position = {keyword: i for i, keyword in enumerate(keywords)}
+    mask = np.zeros((len(window_ids), len(keywords)), dtype=bool)
+    for row, window in enumerate(window_ids):
+        mask[row, [position[keyword] for keyword in smallest_lists[window]]] = True
+    return mask
+
+
+def build_index(mrdf: pd.DataFrame, keywords: list, mask: np.ndarray, k: int, windows: pd.DataFrame,
+                smoothing: int = 10, keyword_columns: bool = True) -> pd.DataFrame:
+    """Averages on the rows each window applies to the residuals of the
+    keywords its row of `mask` selects into the index (row_average{k}), in
+    date order. With keyword_columns, the residuals of the selected
+    keywords are kept in one column per keyword, empty where a keyword is
+    not selected."""
+    order = np.argsort(windows['apply_start'].to_numpy(), kind='stable')
+    windows = windows.iloc[order]
+    rows = np.concatenate([np.arange(start, end) for start, end in zip(windows['apply_start'], windows['apply_end'])])
+    # Window of every row the schedule applies to
+    window = np.repeat(order, windows['apply_end'] - windows['apply_start'])
+
+    residuals = mrdf[keywords].to_numpy(dtype=float)[rows]
+    selected = mask[window] & ~np.isnan(residuals)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        row_average = np.sum(residuals, axis=1, where=selected) / selected.sum(axis=1)
+
+    merged_df = pd.DataFrame({'date': mrdf['dates'].to_numpy()[rows]})
+    if keyword_columns:
+        merged_df = pd.concat([merged_df, pd.DataFrame(np.where(selected, residuals, np.nan), columns=keywords)],
+                              axis=1)
+    merged_df[f'row_average{k}'] = row_average
+    merged_df['smoothed_row_average'] = merged_df[f'row_average{k}'].rolling(window=smoothing).mean()
+    return merged_df
+
+
+def window_index(mrdf: pd.DataFrame, keywords: list, ks, windows: pd.DataFrame, sums: PrefixSums = None,
+                 smoothing: int = 10) -> dict:
+    """{K: index DataFrame} with only the date, row_average{K} and
+    smoothed_row_average columns, for schedules with many windows such as
+    a daily re-ranking."""
+    if sums is None:
+        sums = PrefixSums(mrdf[keywords].to_numpy(), mrdf['return'].to_numpy())
+    ranking = rank_windows(sums, windows['start'], windows['end'], max(ks))
+
+    indices = {}
+    for k in ks:
+        mask = np.zeros((len(windows), len(keywords)), dtype=bool)
+        np.put_along_axis(mask, ranking[:, :k], True, axis=1)
+        indices[k] = build_index(mrdf, keywords, mask, k, windows, smoothing, keyword_columns=False)
+    return indices
+
+
+def compare_schedules(mrdf: pd.DataFrame, keywords: list, schedules: dict, ks=(30,)) -> dict:
+    """{name: {K: index DataFrame}} for every windows frame of `schedules`,
+    all ranked from one set of cumulative sums."""
+    sums = PrefixSums(mrdf[keywords].to_numpy(), mrdf['return'].to_numpy())
+    return {name: window_index(mrdf, keywords, ks, windows, sums) for name, windows in schedules.items()}
+
+
+def cached_volumes(cache: StageCache, folder_path: str = None, panel_path: str = None, min_nonzero: int = 1000,
+                   workers: int = None, verbose: bool = True):
+    """(cache key, (volumes, quality report)) of load_volumes, through the
+    'volumes' stage of the cache."""
+    source = panel_path or folder_path
+    volumes_key = cache.key('volumes', cache.digest(source, prefix='' if panel_path else 'data_'), min_nonzero)
+
+    def volumes():
+        volumes_df, report = load_volumes(folder_path, panel_path, min_nonzero, workers)
+        if verbose:
+            print(f'{volumes_df.shape[1] - 1} of {len(report)} keywords have at least '
+                  f'{min_nonzero} non-zero observations')
+        return volumes_df, report
+    return volumes_key, cache.run('volumes', volumes_key, volumes)
+
+
+def compute_fears(sp500_path: str, ks=(25, 30, 35), folder_path: str = None, panel_path: str = None,
+                  start: str = '2004-01-01', end: str = '2011-12-31', min_nonzero: int = 1000,
+                  limits=(0.025, 0.025), output_dir: str = None, workers: int = None, dtype='float64',
+                  schedule=legacy_windows, walk_forward_every: int = None, smoothing: int = 10,
+                  cache: StageCache = None, excel: bool = False, verbose: bool = True) -> dict:
+    """Runs the FEARS pipeline once and returns {K: index DataFrame} for
+    every K. The search volumes come from the csv folder or, if given, from
+    the panel, and are transformed as `dtype` (float32 halves the memory
+    of the transforms). `schedule` builds the estimation windows from the
+    dates (see fears_windows). With walk_forward_every, the keywords are
+    instead re-ranked every walk_forward_every days on all the days before,
+    on residuals computed without look-ahead (causal_mrdf), and the index
+    only has the date and index columns.
+
+    With a cache (a StageCache or its folder), every stage is stored and
+    reused by later runs with the same inputs and parameters. With
+    output_dir, residuals, mrdf and avg_tstat are written there as Parquet
+    files, and as .xlsx too with excel=True.
+    """
+    cache = cache if isinstance(cache, StageCache) else StageCache(cache)
+    volumes_key, (filtered_merged_all_df, quality_df) = cached_volumes(cache, folder_path, panel_path, min_nonzero,
+                                                                       workers, verbose)
+    if walk_forward_every:
+        causal_key = cache.key('causal', volumes_key, tuple(limits), cache.digest(sp500_path), str(start), str(end))
+        mrdf = cache.run('causal', causal_key, lambda: causal_mrdf(filtered_merged_all_df, sp500_path, start, end,
+                                                                   limits, cache_dir=cache.path))
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            write_table(quality_df, os.path.join(output_dir, 'keyword_quality.parquet'), excel)
+            write_table(mrdf, os.path.join(output_dir, 'mrdf.parquet'), excel)
+        return window_index(mrdf, filtered_merged_all_df.columns[1:].tolist(), ks,
+                            periodic_windows(mrdf['dates'], every=walk_forward_every), smoothing=smoothing)
+
+    transformed_key = cache.key('transformed', volumes_key, tuple(limits), str(dtype))
+    filtered_winsorized_df = cache.run('transformed', transformed_key,
+                                       lambda: transform(filtered_merged_all_df, limits, dtype=dtype))
+
+    residuals_key = cache.key('residuals', transformed_key)
+    residuals_df = cache.run('residuals', residuals_key, lambda: deseasonalize(filtered_winsorized_df))
+    mrdf_key = cache.key('mrdf', residuals_key, cache.digest(sp500_path), str(start), str(end))
+    mrdf = cache.run('mrdf', mrdf_key, lambda: merge_returns(residuals_df, sp500_path, start, end, cache.path))
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        write_table(quality_df, os.path.join(output_dir, 'keyword_quality.parquet'), excel)
+        write_table(residuals_df, os.path.join(output_dir, 'residuals.parquet'), excel)
+        write_table(mrdf, os.path.join(output_dir, 'mrdf.parquet'), excel)
+    keywords = residuals_df.columns[1:].tolist()
+
+    windows = schedule(mrdf['dates'])
+    if verbose:
+        print(windows)
+    t_stats_key = cache.key('tstats', mrdf_key, tuple(windows['start']), tuple(windows['end']))
+    average_t_stats_df = cache.run('tstats', t_stats_key, lambda: rank_keywords(mrdf, keywords, windows))
+    if output_dir is not None:
+        t_stats_df = average_t_stats_df.rename(columns=str).rename_axis('keyword').reset_index()
+        write_table(t_stats_df, os.path.join(output_dir, 'avg_tstat.parquet'), excel)
+
+    indices = {}
+    for k, smallest_lists in select_keywords(average_t_stats_df, ks).items():
+        if verbose:
+            for n, row_names in smallest_lists.items():
+                print(f'{k}_smallest_{n}: {row_names}')
+        mask = selection_mask(keywords, smallest_lists, windows.index)
+        indices[k] = build_index(mrdf, keywords, mask, k, windows, smoothing)
+    if verbose and cache.path is not None:
+        print(f'Stages reused from {cache.path}: {cache.hits or "none"}, computed: {cache.misses or "none"}')
+    return indices
+
+
+def plot_fears(merged_df: pd.DataFrame, column: str, smoothing: int = 10):
+    """Line graph of the smoothed index with a slider for the smoothing.
+    Blocks until the window is closed."""
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+
+    # Every slider position is a difference of the same cumulative sums
+    moving_average = MovingAverage(merged_df[column])
+    fig, ax = plt.subplots(figsize=(12, 6))
+    line, = ax.plot(merged_df['date'], moving_average(smoothing), marker='o', linestyle='-', color='b')
+
+    ax.set_title('Smoothed FEARS index Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Smoothed FEARS index')
+    ax.tick_params(axis='x', rotation=45, labelright=True)
+    ax.grid(True)
+
+    ax_slider = plt.axes([0.1, 0.01, 0.65, 0.03], facecolor='lightgoldenrodyellow')
+    slider = Slider(ax_slider, 'Smoothing Level', 0, 80, valinit=smoothing)
+
+    def update(val):
+        line.set_ydata(moving_average(slider.val))
+        fig.canvas.draw_idle()
+
+    slider.on_changed(update)
+    plt.subplots_adjust(bottom=0.15)
+    plt.show()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute the FEARS index for one or more numbers of keywords K.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--folder', help='folder of the data_{keyword}.csv files')
+    source.add_argument('--panel', help='panel folder written by Adj_Interest_vol.py')
+    parser.add_argument('--sp500', required=True, help='SP500.xlsx with the dates and a return column')
+    parser.add_argument('--k', type=int, nargs='+', default=[25, 30, 35], help='numbers of keywords averaged')
+    parser.add_argument('--start', default='2004-01-01')
+    parser.add_argument('--end', default='2011-12-31')
+    parser.add_argument('--min-nonzero', type=int, default=1000)
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--intermediates', action='store_true',
+                        help='also write residuals, mrdf and avg_tstat to the output folder')
+    parser.add_argument('--excel', action='store_true', help='write .xlsx copies of the Parquet outputs')
+    parser.add_argument('--smoothing', type=int, default=10, help='days of the smoothed_row_average')
+    parser.add_argument('--cache', default='fears_cache', help='folder caching the pipeline stages')
+    parser.add_argument('--no-cache', action='store_true', help='recompute every stage')
+    parser.add_argument('--plot', action='store_true', help='plot the index of the first K')
+    parser.add_argument('--timing', action='store_true', help='print the import, startup and stage times')
+    parser.add_argument('--quiet', action='store_true', help='only print the saved files')
+    parser.add_argument('--workers', type=int, default=None, help='processes reading the csv files')
+    parser.add_argument('--float32', action='store_true', help='transform the volumes as float32')
+    parser.add_argument('--schedule', choices=['legacy', 'expanding', 'rolling', 'half-year', 'quarter'],
+                        default='legacy', help='estimation windows of the ranking')
+    parser.add_argument('--every', type=int, default=130, help='days between rankings (expanding, rolling)')
+    parser.add_argument('--lookback', type=int, default=None,
+                        help='days each ranking uses (rolling, half-year, quarter); all the past by default')
+    parser.add_argument('--walk-forward', type=int, default=None, metavar='DAYS',
+                        help='re-rank the keywords every DAYS days on the past only')
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+                        help='process the panel in chunks of keywords fitting in MB megabytes (fears_chunked.py)')
+    args = parser.parse_args(argv)
+    # CPU time of the interpreter startup and the imports, before any work
+    startup_seconds = process_time()
+    started = perf_counter()
+    cache = StageCache(None if args.no_cache else args.cache)
+    if args.schedule == 'rolling' and args.lookback is None:
+        parser.error('--schedule rolling needs --lookback')
+    if args.memory_budget is not None and args.panel is None:
+        parser.error('--memory-budget needs --panel')
+    if args.memory_budget is not None and args.walk_forward:
+        parser.error('--memory-budget does not run with --walk-forward')
+    if args.memory_budget is not None and args.intermediates:
+        parser.error('--memory-budget does not keep the intermediates of all the keywords, drop --intermediates')
+    schedule = {
+        'legacy': legacy_windows,
+        'expanding': partial(periodic_windows, every=args.every),
+        'rolling': partial(periodic_windows, every=args.every, lookback=args.lookback),
+        'half-year': partial(calendar_windows, freq='6MS', lookback=args.lookback),
+        'quarter': partial(calendar_windows, freq='QS', lookback=args.lookback),
+    }[args.schedule]
+
+    if args.memory_budget is not None:
+        from fears_chunked import compute_fears_chunked
+        indices = compute_fears_chunked(args.sp500, args.panel, args.k, start=args.start, end=args.end,
+                                        min_nonzero=args.min_nonzero, memory_budget=args.memory_budget,
+                                        dtype='float32' if args.float32 else 'float64', schedule=schedule,
+                                        smoothing=args.smoothing, cache_dir=cache.path, verbose=not args.quiet)
+    else:
+        indices = compute_fears(args.sp500, args.k, folder_path=args.folder, panel_path=args.panel,
+                                start=args.start, end=args.end, min_nonzero=args.min_nonzero,
+                                output_dir=args.output_dir if args.intermediates else None, workers=args.workers,
+                                dtype='float32' if args.float32 else 'float64', schedule=schedule,
+                                walk_forward_every=args.walk_forward, smoothing=args.smoothing,
+                                cache=cache, excel=args.excel, verbose=not args.quiet)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for k, merged_df in indices.items():
+        output_path = write_table(merged_df, os.path.join(args.output_dir, f'merged_dataframe_with_first_column{k}'),
+                                  args.excel)
+        print(f"FEARS {k} saved as '{output_path}'")
+
+    if args.timing:
+        print(f'imports: {IMPORT_SECONDS:.2f} s, startup (CPU): {startup_seconds:.2f} s')
+        for stage, seconds in cache.timings.items():
+            print(f'{stage}: {seconds:.2f} s ({"cached" if stage in cache.hits else "computed"})')
+        print(f'total after startup: {perf_counter() - started:.2f} s')
+    if args.plot:
+        k = args.k[0]
+        plot_fears(indices[k], f'row_average{k}', args.smoothing)
+
+
+if __name__ == "__main__":
+    main()
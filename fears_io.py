@@ -0,0 +1,63 @@
+"""Reading and writing the tables of the FEARS scripts.
+
+Writing and reading .xlsx files through openpyxl is often slower than the
+computations, so the outputs are written as Parquet by default and Excel
+copies are only made on request. Excel inputs (SP500.xlsx,
+inquirerbasic.xlsx, ADS.xlsx, ...) are parsed once and kept as Feather
+files named after their content, so later runs read the binary copy until
+the spreadsheet changes.
+"""
+import os
+import tempfile
+import pandas as pd
+from fears_cache import file_digest
+
+
+def read_excel_cached(path: str, cache_dir: str = 'fears_cache') -> pd.DataFrame:
+    """First sheet of an Excel file, read from its Feather copy in
+    cache_dir when the file has not changed since it was converted."""
+    name = os.path.basename(path)
+    cached_path = os.path.join(cache_dir, f'{name}-{file_digest(path)}.feather')
+    if os.path.exists(cached_path):
+        return pd.read_feather(cached_path)
+    df = pd.read_excel(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    for file in os.listdir(cache_dir):
+        # Copies of earlier versions of the file
+        if file.startswith(f'{name}-') and file.endswith('.feather'):
+            os.remove(os.path.join(cache_dir, file))
+    handle, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    os.close(handle)
+    try:
+        df.to_feather(tmp_path)
+        os.replace(tmp_path, cached_path)
+    except (ValueError, TypeError):
+        # Feather needs string column names; such sheets are read from Excel every time
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return df
+
+
+def read_table(path: str, cache_dir: str = 'fears_cache') -> pd.DataFrame:
+    """Reads a .parquet, .feather, .csv or Excel file. Excel files are
+    converted once through read_excel_cached unless cache_dir is None."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(path)
+    if extension == '.feather':
+        return pd.read_feather(path)
+    if extension == '.csv':
+        return pd.read_csv(path)
+    if cache_dir is None:
+        return pd.read_excel(path)
+    return read_excel_cached(path, cache_dir)
+
+
+def write_table(df: pd.DataFrame, path: str, excel: bool = False) -> str:
+    """Writes df as Parquet to `path` (its extension replaced by .parquet),
+    and an .xlsx copy next to it with excel=True. Returns the Parquet path."""
+    stem = os.path.splitext(path)[0]
+    df.to_parquet(stem + '.parquet', index=False)
+    if excel:
+        df.to_excel(stem + '.xlsx', index=False)
+    return stem + '.parquet'
@@ -0,0 +1,342 @@
+"""Online daily update of the FEARS index.
+
+compute_fears rebuilds the index from the first day every time. OnlineFears
+is built once from the history and then folds in one new day of search
+volumes at a time, in constant time per keyword, and returns that day's
+index. Its state is what every stage needs to go on from the last day:
+
+- the last log level of every keyword, for the log difference;
+- streaming estimates of the winsorizing quantiles of every keyword
+  (P2Quantile), in place of sorting the whole history again;
+- the running sums of the regression on the weekday and month dummies,
+  from which the seasonal means and the standard deviation of the
+  residuals are updated;
+- the running sums of the regression of the return on every keyword, and
+  the current top-K keywords, re-ranked on them every day once the return
+  of the day is known (as fears_engine.py --walk-forward 1).
+
+The quantiles and the seasonal fit only use the days up to the current
+one, while the batch pipeline uses the whole sample, so the two indices are
+close but not equal.
+
+    python fears_online.py init --folder csv --sp500 SP500.xlsx --k 30 --state fears_online.pkl
+    python fears_online.py update --state fears_online.pkl --date 2012-01-03 --volumes day.csv --sp500-return 0.01
+
+day.csv holds one row per keyword with the columns keyword and volume.
+"""
+import argparse
+import csv
+import os
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+from fears_io import read_table
+from fears_screening import slope_t_stats, smallest
+from fears_transforms import deseasonalize, log_difference, seasonal_design, winsorize
+
+# Bump when the saved state changes
+STATE_VERSION = 2
+
+
+class P2Quantile:
+    """Streaming estimate of the p quantile of every column with the P-square
+    algorithm (Jain and Chlamtac, 1985): five markers per column, moved in
+    constant time per new value.
+
+    The markers start at the order statistics of the `values` of the
+    history (days x columns). Columns with fewer than 5 values there have
+    no estimate (NaN) until they have 5: their values are kept in `first`
+    until then.
+    """
+
+    def __init__(self, p: float, values: np.ndarray):
+        self.p = p
+        self.increments = np.array([0, p / 2, p, (1 + p) / 2, 1])
+        count = np.count_nonzero(~np.isnan(values), axis=0)
+        self.ready = count >= 5
+        # First values of the columns not ready yet, in the first `seen` rows
+        self.seen = np.where(self.ready, 5, count)
+        self.first = np.full((5, values.shape[1]), np.nan)
+        for column in np.flatnonzero(~self.ready):
+            column_values = values[:, column]
+            self.first[:count[column], column] = column_values[~np.isnan(column_values)]
+        count = np.maximum(count, 5)
+        self.desired = 1 + (count - 1) * self.increments[:, None]
+        positions = np.round(self.desired)
+        # Markers need distinct positions, even for short histories
+        for i in range(1, 5):
+            positions[i] = np.maximum(positions[i], positions[i - 1] + 1)
+        for i in range(3, -1, -1):
+            positions[i] = np.minimum(positions[i], positions[i + 1] - 1)
+        self.positions = positions
+        ordered = np.sort(values, axis=0)
+        index = np.clip(positions.astype(int) - 1, 0, max(len(values) - 1, 0))
+        self.heights = np.take_along_axis(ordered, index, axis=0) if len(values) else np.full(index.shape, np.nan)
+
+    @property
+    def quantile(self) -> np.ndarray:
+        return np.where(self.ready, self.heights[2], np.nan)
+
+    def update(self, x: np.ndarray):
+        """Adds one value per column (NaN for none)."""
+        q, n = self.heights, self.positions
+        valid = self.ready & ~np.isnan(x)
+        starting = ~self.ready & ~np.isnan(x)
+        if starting.any():
+            self._start(np.flatnonzero(starting), x)
+        cell = np.count_nonzero(x[None] >= q[1:4], axis=0)
+        q[0] = np.where(valid & (x < q[0]), x, q[0])
+        q[4] = np.where(valid & (x > q[4]), x, q[4])
+        n += valid & (np.arange(5)[:, None] > cell)
+        self.desired += np.where(valid, self.increments[:, None], 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in (1, 2, 3):
+                d = self.desired[i] - n[i]
+                move = valid & (((d >= 1) & (n[i + 1] - n[i] > 1)) | ((d <= -1) & (n[i - 1] - n[i] < -1)))
+                s = np.sign(d)
+                parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                neighbour_q = np.where(s > 0, q[i + 1], q[i - 1])
+                neighbour_n = np.where(s > 0, n[i + 1], n[i - 1])
+                linear = q[i] + s * (neighbour_q - q[i]) / (neighbour_n - n[i])
+                inside = (q[i - 1] < parabolic) & (parabolic < q[i + 1])
+                q[i] = np.where(move, np.where(inside, parabolic, linear), q[i])
+                n[i] += np.where(move, s, 0)
+
+    def _start(self, columns: np.ndarray, x: np.ndarray):
+        """Keeps the values of the columns not ready yet, and starts the
+        markers of those reaching 5 values at their order statistics."""
+        self.first[self.seen[columns], columns] = x[columns]
+        self.seen[columns] += 1
+        columns = columns[self.seen[columns] == 5]
+        self.heights[:, columns] = np.sort(self.first[:, columns], axis=0)
+        self.positions[:, columns] = np.arange(1, 6)[:, None]
+        self.desired[:, columns] = 1 + 4 * self.increments[:, None]
+        self.ready[columns] = True
+
+
+class OnlineFears:
+    """FEARS index updated one day at a time.
+
+    `volumes_df` is the history of the search volumes in the layout of
+    fears_engine.load_volumes (dates first, one column per keyword, already
+    filtered) and `returns` the S&P 500 returns indexed by date, over the
+    period the keywords are ranked on.
+    """
+
+    def __init__(self, volumes_df: pd.DataFrame, returns: pd.Series, k: int = 30, limits=(0.025, 0.025),
+                 epsilon: float = 1e-10, min_history: int = 130):
+        self.keywords = volumes_df.columns[1:].tolist()
+        self.k, self.limits, self.epsilon, self.min_history = k, tuple(limits), epsilon, min_history
+        dates = pd.DatetimeIndex(pd.to_datetime(volumes_df.iloc[:, 0]))
+        values = volumes_df.iloc[:, 1:].to_numpy(dtype=float)
+        self.last_date = dates[-1]
+        self.last_level = np.log(values[-1] + epsilon)
+
+        log_diff = log_difference(values, epsilon)
+        self.low = P2Quantile(limits[0], log_diff)
+        self.high = P2Quantile(1 - limits[1], log_diff)
+        clipped = winsorize(log_diff, limits)
+
+        # Sums of the seasonal regression of every keyword over its valid days
+        X = seasonal_design(dates)
+        valid = ~np.isnan(clipped)
+        y = np.where(valid, clipped, 0.0)
+        self.xtx = (valid.T.astype(float) @ (X[:, :, None] * X[:, None, :]).reshape(len(X), -1)).reshape(
+            len(self.keywords), X.shape[1], X.shape[1])
+        self.xty = y.T @ X
+        self.yty = (y * y).sum(axis=0)
+        self.count = valid.sum(axis=0)
+        beta, scale = self._seasonal_fit()
+        residuals = (clipped - X @ beta.T) / scale
+
+        # Sums of the regression of the return on every keyword
+        day_returns = pd.Series(returns, dtype=float).reindex(dates).to_numpy()
+        valid = np.isfinite(residuals) & ~np.isnan(day_returns)[:, None]
+        x = np.where(valid, residuals, 0.0)
+        y = np.where(valid, day_returns[:, None], 0.0)
+        self.sums = {'n': valid.sum(axis=0).astype(float), 'x': x.sum(axis=0), 'y': y.sum(axis=0),
+                     'xx': (x * x).sum(axis=0), 'yy': (y * y).sum(axis=0), 'xy': (x * y).sum(axis=0)}
+        self.ranked_days = int(np.count_nonzero(~np.isnan(day_returns)))
+        self.selection = None
+        self._rank()
+
+    def _seasonal_fit(self):
+        """Seasonal coefficients and residual standard deviation of every
+        keyword. Dummies of categories a keyword never had are left at 0.
+        The scale is NaN, as in fears_transforms.deseasonalize, for keywords
+        with no more days than dummies they had, or no residual variance."""
+        # Keywords missing on the same days share their X'X, inverted once
+        groups = {}
+        group = np.array([groups.setdefault(xtx.tobytes(), len(groups)) for xtx in self.xtx], dtype=int)
+        first = np.unique(group, return_index=True)[1]
+        xtx_pinv = np.linalg.pinv(self.xtx[first])[group]
+        rank = np.linalg.matrix_rank(self.xtx[first])[group] if len(first) else np.zeros(0, dtype=int)
+        beta = np.einsum('kij,kj->ki', xtx_pinv, self.xty)
+        residual_sum = self.yty - (beta * self.xty).sum(axis=1)
+        fitted = (self.count > rank) & (residual_sum > 1e-12 * self.yty)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(fitted, np.sqrt(np.maximum(residual_sum, 0) / (self.count - 1)), np.nan)
+        return beta, scale
+
+    def _rank(self):
+        if self.ranked_days >= self.min_history:
+            t_stats = slope_t_stats(*(self.sums[name] for name in ('n', 'x', 'y', 'xx', 'yy', 'xy')))
+            self.selection = smallest(t_stats[None, :], self.k)[0]
+
+    @property
+    def top_keywords(self) -> list:
+        """Keywords averaged into the next index value."""
+        return [] if self.selection is None else [self.keywords[i] for i in self.selection]
+
+    def fold(self, day, volumes: np.ndarray) -> np.ndarray:
+        """Folds in the volumes of `day` (an array in keyword order, NaN
+        where missing) and returns the deseasonalized volume changes of the
+        day, from the quantiles of the days up to it and the seasonal fit of
+        the days before it."""
+        if pd.Timestamp(day) <= self.last_date:
+            raise ValueError(f'{day} is not after the last day of the state, {self.last_date.date()}')
+        level = np.log(volumes + self.epsilon)
+        log_diff = level - self.last_level
+        self.last_level = level
+        self.last_date = pd.Timestamp(day)
+
+        self.low.update(log_diff)
+        self.high.update(log_diff)
+        low, high = self.low.quantile, self.high.quantile
+        clipped = np.clip(log_diff, np.where(np.isnan(low), -np.inf, low), np.where(np.isnan(high), np.inf, high))
+
+        # The residual of the day comes from the fit of the days before, so
+        # that the first day of a month is not fitted on itself alone
+        x = seasonal_design([self.last_date])[0]
+        beta, scale = self._seasonal_fit()
+        residuals = (clipped - beta @ x) / scale
+        valid = ~np.isnan(clipped)
+        y = np.where(valid, clipped, 0.0)
+        self.xtx += valid[:, None, None] * np.outer(x, x)
+        self.xty += y[:, None] * x
+        self.yty += y * y
+        self.count += valid
+        return residuals
+
+    def update(self, day, volumes, sp500_return: float = None) -> float:
+        """Folds in the volumes of `day` ({keyword: volume} or a Series;
+        missing keywords are NaN) and returns the index of the day: the
+        average deseasonalized volume change of the current top-K keywords.
+        With the day's return, the keywords are then re-ranked for the next
+        day."""
+        residuals = self.fold(day, pd.Series(volumes, dtype=float).reindex(self.keywords).to_numpy())
+        value = np.nan
+        if self.selection is not None:
+            selected = residuals[self.selection]
+            if (~np.isnan(selected)).any():
+                value = float(np.nanmean(selected))
+
+        if sp500_return is not None and not np.isnan(sp500_return):
+            valid = np.isfinite(residuals)
+            x = np.where(valid, residuals, 0.0)
+            y = np.where(valid, sp500_return, 0.0)
+            for name, term in (('n', valid), ('x', x), ('y', y), ('xx', x * x), ('yy', y * y), ('xy', x * y)):
+                self.sums[name] += term
+            self.ranked_days += 1
+            self._rank()
+        return value
+
+    def save(self, path: str):
+        """Pickles the state as a dict of arrays, lists and numbers, with no
+        reference to these classes, so it loads whether it was saved by the
+        script or by an importer of the module."""
+        state = {name: dict(value.__dict__) if isinstance(value, P2Quantile) else value
+                 for name, value in self.__dict__.items()}
+        handle, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(handle, 'wb') as file:
+            pickle.dump({'version': STATE_VERSION, 'state': state}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> 'OnlineFears':
+        with open(path, 'rb') as file:
+            saved = pickle.load(file)
+        if saved.get('version') != STATE_VERSION:
+            raise ValueError(f'{path} holds a state of another version, run init again')
+        online = OnlineFears.__new__(OnlineFears)
+        for name, value in saved['state'].items():
+            if name in ('low', 'high'):
+                quantile = P2Quantile.__new__(P2Quantile)
+                quantile.__dict__.update(value)
+                value = quantile
+            setattr(online, name, value)
+        return online
+
+
+def causal_residuals(volumes_df: pd.DataFrame, warm_up: int, limits=(0.025, 0.025),
+                     epsilon: float = 1e-10) -> pd.DataFrame:
+    """Residuals of fears_engine.deseasonalize for `volumes_df` (layout of
+    fears_engine.load_volumes) in which every day after the first warm_up
+    rows is winsorized and deseasonalized with the quantiles and seasonal
+    fit of the days up to it only, as OnlineFears would have computed it.
+    The first warm_up rows are fitted on themselves."""
+    dates = pd.DatetimeIndex(pd.to_datetime(volumes_df.iloc[:, 0]))
+    values = volumes_df.iloc[:, 1:].to_numpy(dtype=float)
+    residuals = np.empty_like(values)
+    residuals[:warm_up] = deseasonalize(winsorize(log_difference(values[:warm_up], epsilon), limits),
+                                        dates[:warm_up])
+    online = OnlineFears(volumes_df.iloc[:warm_up], pd.Series(dtype=float), limits=limits, epsilon=epsilon)
+    for row in range(warm_up, len(values)):
+        residuals[row] = online.fold(dates[row], values[row])
+    residuals_df = pd.DataFrame(residuals, index=volumes_df.index, columns=volumes_df.columns[1:], copy=False)
+    residuals_df.insert(0, 'dates', volumes_df.iloc[:, 0])
+    return residuals_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Online daily update of the FEARS index.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    init = commands.add_parser('init', help='build the state from the history')
+    source = init.add_mutually_exclusive_group(required=True)
+    source.add_argument('--folder', help='folder of the data_{keyword}.csv files')
+    source.add_argument('--panel', help='panel folder written by Adj_Interest_vol.py')
+    init.add_argument('--sp500', required=True, help='SP500.xlsx with the dates and a return column')
+    init.add_argument('--k', type=int, default=30)
+    init.add_argument('--start', default='2004-01-01')
+    init.add_argument('--end', default=None, help='last day of the history (all of it by default)')
+    init.add_argument('--min-nonzero', type=int, default=1000)
+    init.add_argument('--state', default='fears_online.pkl')
+    update = commands.add_parser('update', help='fold in one new day')
+    update.add_argument('--state', default='fears_online.pkl')
+    update.add_argument('--date', required=True)
+    update.add_argument('--volumes', required=True, help='csv with the columns keyword and volume')
+    update.add_argument('--sp500-return', type=float, default=None, help="the day's S&P 500 return, if known")
+    update.add_argument('--output', default='fears_online.csv', help='csv the index values are appended to')
+    args = parser.parse_args(argv)
+
+    if args.command == 'init':
+        from fears_engine import load_volumes
+        volumes_df, _ = load_volumes(args.folder, args.panel, args.min_nonzero)
+        dates = pd.to_datetime(volumes_df['Dates'])
+        volumes_df = volumes_df[(dates >= pd.Timestamp(args.start)) &
+                                (dates <= pd.Timestamp(args.end or dates.iloc[-1]))]
+        sp = read_table(args.sp500)
+        returns = sp.set_index(pd.to_datetime(sp.iloc[:, 0]))['return']
+        online = OnlineFears(volumes_df, returns.loc[args.start:volumes_df['Dates'].iloc[-1]], args.k)
+        online.save(args.state)
+        print(f'{len(online.keywords)} keywords up to {online.last_date.date()}, top {args.k}: {online.top_keywords}')
+        return
+
+    online = OnlineFears.load(args.state)
+    day_df = pd.read_csv(args.volumes)
+    value = online.update(args.date, day_df.set_index('keyword')['volume'], args.sp500_return)
+    online.save(args.state)
+    new_file = not os.path.exists(args.output)
+    with open(args.output, 'a', newline='') as file:
+        writer = csv.writer(file)
+        if new_file:
+            writer.writerow(['date', f'fears{online.k}'])
+        writer.writerow([args.date, value])
+    print(f'FEARS {online.k} on {args.date}: {value}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Closed-form t-statistic screening of the keywords for fears_engine.py.
+
+The keywords are ranked by the t-statistic of the slope in the regression
+of the S&P 500 return on each keyword alone. For a univariate regression
+with an intercept the t-statistic only depends on the sums of x, y, x^2,
+y^2 and xy over the sample, so PrefixSums keeps the cumulative sums of
+these for every keyword once and the t-statistics of any number of
+samples are array operations on them, with no model fit.
+"""
+import numpy as np
+
+
+def slope_t_stats(n, sx, sy, sxx, syy, sxy) -> np.ndarray:
+    """t-statistics of the slope from the sums over a sample of 1, x, y,
+    x^2, y^2 and xy. NaN where the sample has fewer than 3 days or x is
+    constant over it."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxx = sxx - sx * sx / n
+        syy = syy - sy * sy / n
+        sxy = sxy - sx * sy / n
+        beta = sxy / sxx
+        residual_variance = (syy - beta * sxy) / (n - 2)
+        t_stats = beta / np.sqrt(residual_variance / sxx)
+    return np.where(n < 3, np.nan, t_stats)
+
+
+def _cumulative(values: np.ndarray) -> np.ndarray:
+    """Cumulative sums along the rows with a leading row of zeros, so the
+    sum over rows [start, end) is sums[end] - sums[start]."""
+    sums = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=sums[1:])
+    return sums
+
+
+class PrefixSums:
+    """Cumulative regression sums of y on every column of x (days x keywords).
+
+    Days where the keyword or y is missing (or infinite) are left out of
+    that keyword's sums.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        valid = np.isfinite(x) & np.isfinite(y)[:, None]
+        x = np.where(valid, x, 0.0)
+        y = np.where(valid, y[:, None], 0.0)
+        self.n = _cumulative(valid.astype(float))
+        self.x = _cumulative(x)
+        self.y = _cumulative(y)
+        self.xx = _cumulative(x * x)
+        self.yy = _cumulative(y * y)
+        self.xy = _cumulative(x * y)
+
+    def __len__(self):
+        return self.n.shape[0] - 1
+
+    def t_stats(self, starts, ends) -> np.ndarray:
+        """(samples x keywords) t-statistics of the slope for the samples of
+        rows [starts[i], ends[i]). NaN where a sample has fewer than 3 days
+        or a keyword is constant over it."""
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+
+        def window(sums):
+            return sums[ends] - sums[starts]
+
+        return slope_t_stats(window(self.n), window(self.x), window(self.y), window(self.xx), window(self.yy),
+                             window(self.xy))
+
+
+def smallest(t_stats: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k smallest t-statistics of every row (sample),
+    in increasing order. Missing t-statistics are never selected unless a
+    row has fewer than k others."""
+    k = min(k, t_stats.shape[1])
+    ordered = np.where(np.isnan(t_stats), np.inf, t_stats)
+    candidates = np.argpartition(ordered, k - 1, axis=1)[:, :k] if k < t_stats.shape[1] else \
+        np.tile(np.arange(t_stats.shape[1]), (t_stats.shape[0], 1))
+    values = np.take_along_axis(ordered, candidates, axis=1)
+    # Ties keep the keyword order, as nsmallest does
+    order = np.lexsort((candidates, values), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def rank_windows(sums: PrefixSums, starts, ends, k: int, block: int = 256) -> np.ndarray:
+    """(windows x k) column indices of the k smallest t-statistics of every
+    sample [starts[i], ends[i]). The t-statistics are computed block samples
+    at a time, so even a daily schedule needs little memory."""
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    selections = np.empty((len(ends), min(k, sums.n.shape[1])), dtype=int)
+    for start in range(0, len(ends), block):
+        selections[start:start + block] = smallest(sums.t_stats(starts[start:start + block],
+                                                                ends[start:start + block]), k)
+    return selections
@@ -0,0 +1,156 @@
+"""Sensitivity of the FEARS index to its parameters.
+
+python fears_sweep.py --folder csv --sp500 SP500.xlsx --k 25 30 35 \
+    --limits 0.01 0.025 0.05 --min-nonzero 800 1000 --step 120 130 --smoothing 1 10
+
+builds the index for every combination of K, winsorizing limits, minimum
+number of non-zero days, window step (of the legacy schedule) and
+smoothing, and writes two tables to --output-dir:
+
+- sweep_results.parquet: one row per combination with the correlation of
+  the index with the index of the original paper (Original_Data.csv, same
+  K and smoothing) and the t-statistics of the S&P 500 returns of the same
+  day (lag 0) and of the next day (lag 1) regressed on the index;
+- sweep_series.parquet: the index of every combination, one row per
+  combination and day.
+
+Every combination of limits, minimum number of non-zero days and step
+runs in one process of a pool, after the volumes of every minimum were
+read once into the stage cache (fears_cache.py), from which the processes
+share them. K and the smoothing are applied to the rankings of a step
+without computing anything else again.
+"""
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from fears_cache import StageCache
+from fears_engine import cached_volumes, compute_fears
+from fears_io import read_table, write_table
+from fears_screening import PrefixSums
+from fears_windows import legacy_windows
+from smoothing import MovingAverage
+
+PARAMETERS = ['k', 'low_limit', 'up_limit', 'min_nonzero', 'step', 'smoothing']
+
+
+def load_original(path: str = 'Original_Data.csv') -> pd.DataFrame:
+    """Index of the original paper (fears25, fears30, fears35) by date."""
+    original_df = read_table(path)
+    original_df['date'] = pd.to_datetime(original_df['date'], format='%m/%d/%Y')
+    return original_df.set_index('date')
+
+
+def t_stat(x, y) -> float:
+    """t-statistic of the slope of y regressed on x, leaving out missing days."""
+    return PrefixSums(np.asarray(x, dtype=float)[:, None], y).t_stats([0], [len(x)])[0, 0]
+
+
+def evaluate(dates, index, original_df: pd.DataFrame, returns_df: pd.DataFrame, k: int, smoothing: int,
+             lags=(0, 1)) -> dict:
+    """Correlation with the original index of the same K and t-statistics
+    of the returns `lag` days later regressed on the index, for the index
+    smoothed over `smoothing` days."""
+    dates = pd.DatetimeIndex(dates)
+    smoothed = MovingAverage(index)(smoothing)
+    metrics = {}
+    if f'fears{k}' in original_df:
+        original = MovingAverage(original_df[f'fears{k}'])(smoothing)
+        original = pd.Series(original, index=original_df.index).reindex(dates).to_numpy()
+        metrics['correlation'] = pd.Series(smoothed).corr(pd.Series(original))
+    else:
+        metrics['correlation'] = np.nan
+    # Returns of every trading day, so the lags skip non-trading days only
+    positions = returns_df.index.get_indexer(dates)
+    for column in returns_df.columns:
+        returns = returns_df[column].to_numpy()
+        for lag in lags:
+            ahead = positions + lag
+            valid = (positions >= 0) & (ahead < len(returns))
+            y = np.where(valid, returns[np.clip(ahead, 0, len(returns) - 1)], np.nan)
+            metrics[f't_{column}_{lag}'] = t_stat(smoothed, y)
+    return metrics
+
+
+def run_step(limits, min_nonzero: int, step: int, sp500_path: str, folder_path: str, panel_path: str, ks,
+             smoothings, original_path: str, cache: str, workers: int = None):
+    """Results and series of every combination of K and smoothing for the
+    given limits, min_nonzero and step."""
+    original_df = load_original(original_path)
+    returns_df = read_table(sp500_path, cache)
+    returns_df = returns_df.set_index(pd.DatetimeIndex(returns_df.pop('date'))).sort_index()
+    indices = compute_fears(sp500_path, ks, folder_path, panel_path, min_nonzero=min_nonzero, limits=limits,
+                            workers=workers, schedule=partial(legacy_windows, step=step), cache=cache, verbose=False)
+    results, series = [], []
+    for (k, index_df), smoothing in itertools.product(indices.items(), smoothings):
+        parameters = dict(zip(PARAMETERS, (k, *limits, min_nonzero, step, smoothing)))
+        index = index_df[f'row_average{k}'].to_numpy()
+        results.append({**parameters, 'days': len(index_df),
+                        **evaluate(index_df['date'], index, original_df, returns_df, k, smoothing)})
+        series.append(pd.DataFrame({**parameters, 'date': index_df['date'].to_numpy(),
+                                    'fears': MovingAverage(index)(smoothing)}))
+    return results, series
+
+
+def sweep(sp500_path: str, folder_path: str = None, panel_path: str = None, ks=(25, 30, 35),
+          limits=((0.025, 0.025),), min_nonzero=(1000,), steps=(130,), smoothings=(10,),
+          original_path: str = 'Original_Data.csv', cache: str = 'fears_cache', workers: int = None):
+    """(results, series) DataFrames of every combination of the parameters.
+    Every (limits, min_nonzero, step) runs in a pool of `workers`
+    processes, once the volumes of every min_nonzero, the only stage they
+    all share, are in the cache."""
+    # Read here so the workers do not read the csv files, or write the same
+    # cache files, at the same time; the S&P 500 copy is cached here too
+    stage_cache = StageCache(cache)
+    for minimum in min_nonzero:
+        cached_volumes(stage_cache, folder_path, panel_path, minimum, workers, verbose=False)
+    read_table(sp500_path, stage_cache.path)
+    runs = list(itertools.product([tuple(limit) for limit in limits], min_nonzero, steps))
+    run = partial(run_step, sp500_path=sp500_path, folder_path=folder_path, panel_path=panel_path, ks=ks,
+                  smoothings=smoothings, original_path=original_path, cache=cache, workers=1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        outputs = list(executor.map(run, *zip(*runs)))
+    results = pd.DataFrame([row for run_results, _ in outputs for row in run_results])
+    series = pd.concat([frame for _, run_series in outputs for frame in run_series], ignore_index=True)
+    return results, series
+
+
+def parse_limits(value: str) -> tuple:
+    """'0.025' for the same lower and upper limit, '0.01,0.05' for both."""
+    limits = tuple(float(limit) for limit in value.split(','))
+    return limits * 2 if len(limits) == 1 else limits
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sensitivity of the FEARS index to its parameters.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--folder', help='folder of the data_{keyword}.csv files')
+    source.add_argument('--panel', help='panel folder written by Adj_Interest_vol.py')
+    parser.add_argument('--sp500', required=True, help='SP500.xlsx with the dates and return columns')
+    parser.add_argument('--original', default='Original_Data.csv', help='index of the original paper')
+    parser.add_argument('--k', type=int, nargs='+', default=[25, 30, 35])
+    parser.add_argument('--limits', type=parse_limits, nargs='+', default=[(0.025, 0.025)],
+                        help='winsorizing limits, as 0.025 or 0.01,0.05 (lower,upper)')
+    parser.add_argument('--min-nonzero', type=int, nargs='+', default=[1000])
+    parser.add_argument('--step', type=int, nargs='+', default=[130], help='rows between the regressions')
+    parser.add_argument('--smoothing', type=int, nargs='+', default=[10], help='days averaged (1 for none)')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--excel', action='store_true', help='also write .xlsx copies')
+    parser.add_argument('--cache', default='fears_cache', help='folder of the stage cache')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    results, series = sweep(args.sp500, args.folder, args.panel, args.k, args.limits, args.min_nonzero, args.step,
+                            args.smoothing, args.original, args.cache, args.workers)
+    print(results.to_string(index=False))
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name, df in (('sweep_results', results), ('sweep_series', series)):
+        output_path = write_table(df, os.path.join(args.output_dir, f'{name}.parquet'), args.excel)
+        print(f"{name} saved as '{output_path}'")
+
+
+if __name__ == "__main__":
+    main()
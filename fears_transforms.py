@@ -0,0 +1,90 @@
+"""Whole-matrix transforms of the search volumes for fears_engine.py.
+
+The volumes are a (days x keywords) NumPy matrix and every transform works
+on all the keywords at once instead of looping over the columns. Missing
+values stay missing and are left out of the quantiles. Passing
+dtype='float32' halves the memory of the matrices.
+"""
+import numpy as np
+import pandas as pd
+
+
+def log_difference(values: np.ndarray, epsilon: float = 1e-10, dtype='float64') -> np.ndarray:
+    """log(x_t + epsilon) - log(x_t-1 + epsilon) of every column; the first
+    row is NaN. The small constant avoids the log of zero."""
+    logs = np.array(values, dtype=dtype)
+    logs += epsilon
+    np.log(logs, out=logs)
+    log_diff = np.empty_like(logs)
+    log_diff[0] = np.nan
+    np.subtract(logs[1:], logs[:-1], out=log_diff[1:])
+    return log_diff
+
+
+def winsorize(values: np.ndarray, limits=(0.025, 0.025), block_columns: int = 512) -> np.ndarray:
+    """Clips every column, in place, to its order statistics at the lower
+    and upper `limits`, the way scipy.stats.mstats.winsorize does but over
+    the non-missing values of each column only.
+
+    The columns are sorted block_columns at a time, which bounds the extra
+    memory to one sorted block.
+    """
+    low_limit, up_limit = limits
+    for start in range(0, values.shape[1], block_columns):
+        block = values[:, start:start + block_columns]
+        # NaNs sort last, so the n first values of a column are its valid ones
+        ordered = np.sort(block, axis=0)
+        n = np.count_nonzero(~np.isnan(block), axis=0)
+        valid = n > 0
+        low_index = (low_limit * n).astype(int) if low_limit else np.zeros_like(n)
+        up_index = n - (up_limit * n).astype(int) - 1 if up_limit else n - 1
+        low = np.take_along_axis(ordered, np.where(valid, low_index, 0)[None, :], axis=0)[0]
+        high = np.take_along_axis(ordered, np.where(valid, up_index, 0)[None, :], axis=0)[0]
+        np.clip(block, low, high, out=block)
+    return values
+
+
+def transform(df: pd.DataFrame, limits=(0.025, 0.025), epsilon: float = 1e-10, dtype='float64') -> pd.DataFrame:
+    """Log difference and winsorizing of every column but the first (the
+    dates), returned with the dates as first column."""
+    values = winsorize(log_difference(df.iloc[:, 1:].to_numpy(), epsilon, dtype), limits)
+    transformed_df = pd.DataFrame(values, index=df.index, columns=df.columns[1:], copy=False)
+    transformed_df.insert(0, df.columns[0], df.iloc[:, 0])
+    return transformed_df
+
+
+def seasonal_design(dates) -> np.ndarray:
+    """Constant plus weekday and month dummies (Monday and January left out)."""
+    dates = pd.DatetimeIndex(dates)
+    weekday = pd.get_dummies(pd.Categorical(dates.weekday, categories=range(7)), drop_first=True)
+    month = pd.get_dummies(pd.Categorical(dates.month, categories=range(1, 13)), drop_first=True)
+    return np.column_stack([np.ones(len(dates)), weekday.to_numpy(dtype=float), month.to_numpy(dtype=float)])
+
+
+def deseasonalize(values: np.ndarray, dates) -> np.ndarray:
+    """Residuals of every column regressed on the weekday and month dummies
+    of `dates`, divided by their standard deviation.
+
+    The design is the same for every keyword, so it is factorized with one
+    QR decomposition and all the columns are solved together. Columns
+    missing on different days are grouped by their pattern of missing
+    days, and each pattern gets its own factorization; dummies of
+    categories a pattern never sees are dropped.
+    """
+    X = seasonal_design(dates)
+    valid = ~np.isnan(values)
+    residuals = np.full(values.shape, np.nan, dtype=values.dtype)
+    # Group the columns by their pattern of valid days
+    patterns, groups = np.unique(np.packbits(valid, axis=0).T, axis=0, return_inverse=True)
+    for group in range(len(patterns)):
+        columns = np.flatnonzero(groups.ravel() == group)
+        rows = valid[:, columns[0]]
+        design = X[rows][:, X[rows].any(axis=0)]
+        if rows.sum() <= design.shape[1]:
+            continue
+        Q, _ = np.linalg.qr(design)
+        Y = values[np.ix_(rows, columns)].astype(float, copy=False)
+        Y -= Q @ (Q.T @ Y)
+        Y /= Y.std(axis=0, ddof=1)
+        residuals[np.ix_(rows, columns)] = Y
+    return residuals
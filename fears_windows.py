@@ -0,0 +1,81 @@
+"""Estimation window schedules for fears_engine.py.
+
+A schedule says on which days the keywords are ranked and on which days
+each ranking is used. It is a DataFrame with one row per window:
+
+- start, end: the rows [start, end) of the merged residuals and returns
+  the keywords are ranked on;
+- apply_start, apply_end: the rows [apply_start, apply_end) whose index
+  averages the keywords of that ranking;
+- estimation_start, apply_from: the first dates of both, for reading.
+
+Every ranking is a difference of the same cumulative sums
+(fears_screening.PrefixSums), so any number of schedules can be compared
+for the cost of computing the sums once.
+"""
+import numpy as np
+import pandas as pd
+
+
+def windows_frame(dates, starts, ends, apply_starts, apply_ends) -> pd.DataFrame:
+    dates = pd.DatetimeIndex(dates)
+    windows = pd.DataFrame({'start': starts, 'end': ends, 'apply_start': apply_starts, 'apply_end': apply_ends})
+    windows = windows.astype(int)
+    windows.insert(0, 'estimation_start', dates[windows['start']])
+    windows.insert(1, 'apply_from', dates[windows['apply_start']])
+    return windows
+
+
+def _estimation_starts(dates: pd.DatetimeIndex, ends: np.ndarray, lookback) -> np.ndarray:
+    """First row of each estimation sample ending at `ends`: 0 for an
+    expanding window, `lookback` rows or a date offset (e.g.
+    pd.DateOffset(years=2)) before the end for a rolling one."""
+    if lookback is None:
+        return np.zeros_like(ends)
+    if isinstance(lookback, (int, np.integer)):
+        return np.maximum(ends - lookback, 0)
+    return dates.searchsorted(dates[ends] - lookback)
+
+
+def legacy_windows(dates, num_regressions: int = 15, gap: int = 7, step: int = None,
+                   num_splits: int = 16) -> pd.DataFrame:
+    """The schedule of the original scripts: regression n is applied to the
+    n-th last of num_splits equal blocks of rows and estimated on the rows
+    up to `gap` rows before the first of these blocks, less step * n rows
+    (by default the rows of a block, so every sample ends `gap` rows before
+    its block). On the 2087 days of the paper, the samples end at rows
+    1950, 1820, ..., as in the scripts."""
+    total_rows = len(dates)
+    rows_per_split = total_rows // num_splits
+    step = rows_per_split if step is None else step
+    n = np.arange(num_regressions)
+    apply_starts = total_rows - (n + 1) * rows_per_split
+    ends = apply_starts[0] - gap - step * n
+    if ends[-1] < 3:
+        raise ValueError(f'{total_rows} rows with step {step} leave fewer than 3 rows to the last of '
+                         f'{num_regressions} regressions')
+    return windows_frame(dates, np.zeros_like(ends), ends, apply_starts, total_rows - n * rows_per_split)
+
+
+def periodic_windows(dates, every: int = 130, lookback=None, min_history: int = 130) -> pd.DataFrame:
+    """Re-ranks every `every` rows from row min_history on, on the rows
+    before (all of them, or the last `lookback`), and applies each ranking
+    until the next one. every=1 re-ranks daily."""
+    apply_starts = np.arange(min_history, len(dates), every)
+    apply_ends = np.append(apply_starts[1:], len(dates))
+    return windows_frame(dates, _estimation_starts(pd.DatetimeIndex(dates), apply_starts, lookback), apply_starts,
+                         apply_starts, apply_ends)
+
+
+def calendar_windows(dates, freq: str = '6MS', lookback=None, min_history: int = 130) -> pd.DataFrame:
+    """Re-ranks at the start of every calendar period of `freq` ('6MS'
+    half-years, 'QS' quarters, 'MS' months) once min_history rows are
+    available, on the rows before, and applies the ranking to the period."""
+    dates = pd.DatetimeIndex(dates)
+    period_starts = pd.date_range(dates[0].to_period('Y').start_time, dates[-1], freq=freq)
+    apply_starts = np.unique(dates.searchsorted(period_starts))
+    apply_starts = apply_starts[(apply_starts >= min_history) & (apply_starts < len(dates))]
+    apply_ends = np.append(apply_starts[1:], len(dates))
+    return windows_frame(dates, _estimation_starts(dates, apply_starts, lookback), apply_starts, apply_starts,
+                         apply_ends)
+
@@ -0,0 +1,71 @@
+"""On-disk store of the Google Trends windows fetched by Adj_Interest_vol.py.
+
+Every fetched window is one row of an SQLite table keyed by
+(keyword, geo, timeframe), written once in its own transaction as soon as
+the request completes, so a crash or a restart loses nothing and resumes
+exactly where the fetching stopped.
+"""
+import pickle
+import sqlite3
+import threading
+import pandas as pd
+
+
+class FetchStore:
+    """SQLite table of fetched windows keyed by (keyword, geo, timeframe)."""
+
+    def __init__(self, path: str = 'fetch_store.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        if path != ':memory:':
+            # Lets several processes read while one of them writes
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS windows ('
+                               'keyword TEXT NOT NULL, geo TEXT NOT NULL, timeframe TEXT NOT NULL, '
+                               'frame BLOB NOT NULL, '
+                               'fetched_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP, '
+                               'PRIMARY KEY (keyword, geo, timeframe))')
+        # Keys already on disk, so the common "is it fetched yet" check is a set lookup
+        self._keys = set(self._conn.execute('SELECT keyword, geo, timeframe FROM windows'))
+
+    def has(self, keyword: str, geo: str, timeframe: str) -> bool:
+        key = (keyword, geo, timeframe)
+        if key in self._keys:
+            return True
+        # Another process may have written it since the store was opened
+        with self._lock:
+            found = self._conn.execute('SELECT 1 FROM windows WHERE keyword = ? AND geo = ? AND timeframe = ?',
+                                       key).fetchone() is not None
+        if found:
+            self._keys.add(key)
+        return found
+
+    def get(self, keyword: str, geo: str, timeframe: str):
+        """Returns the stored frame, or None if the window was never fetched."""
+        with self._lock:
+            row = self._conn.execute('SELECT frame FROM windows WHERE keyword = ? AND geo = ? AND timeframe = ?',
+                                     (keyword, geo, timeframe)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def put(self, keyword: str, geo: str, timeframe: str, frame: pd.DataFrame):
+        """Writes a window unless it is already stored."""
+        key = (keyword, geo, timeframe)
+        if key in self._keys:
+            return
+        blob = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO windows (keyword, geo, timeframe, frame) VALUES (?, ?, ?, ?)',
+                               key + (blob,))
+        self._keys.add(key)
+
+    def timeframes(self, keyword: str, geo: str) -> list:
+        """Timeframes stored for a keyword, in chronological order."""
+        with self._lock:
+            rows = self._conn.execute('SELECT timeframe FROM windows WHERE keyword = ? AND geo = ? '
+                                      'ORDER BY timeframe', (keyword, geo)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,69 @@
+"""Per-request telemetry of the Google Trends fetching.
+
+Telemetry appends one JSON line per request (time waited for the rate
+limiter, latency, HTTP status, bytes received, attempt, request rate) and
+one line per change of the request rate to a metrics file.
+summarize_telemetry turns that file into a breakdown of where the
+wall-clock time of a collection went. Run `python fetch_telemetry.py
+fetch_telemetry.jsonl` to print it.
+"""
+import json
+import sys
+import threading
+from time import time
+import pandas as pd
+
+
+class Telemetry:
+    """Thread-safe JSON lines writer for request and rate events."""
+
+    def __init__(self, path: str = 'fetch_telemetry.jsonl'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, event: str = 'request', **fields):
+        line = json.dumps({'time': time(), 'event': event, **fields}, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def summarize_telemetry(path: str = 'fetch_telemetry.jsonl') -> dict:
+    """Breakdown of the requests recorded in a telemetry file.
+
+    The seconds spent waiting for the limiter include the pauses after 429s;
+    waiting and requesting are summed over all the workers, so together they
+    can exceed the wall-clock time of a run with several workers.
+    """
+    events = pd.read_json(path, lines=True)
+    requests = events[events['event'] == 'request']
+    if requests.empty:
+        return {'requests': 0}
+    status = requests['status'].fillna(0).astype(int)
+    elapsed = requests['time'].max() - requests['time'].min()
+    rates = events.loc[events['event'] == 'rate', 'rate']
+    return {
+        'requests': len(requests),
+        'succeeded': int((status == 200).sum()),
+        'throttled': int((status == 429).sum()),
+        'other_errors': int(((status != 200) & (status != 429)).sum()),
+        'retries': int((requests['attempt'] > 1).sum()),
+        'wall_clock_s': elapsed,
+        'requests_per_minute': 60 * len(requests) / elapsed if elapsed > 0 else float('nan'),
+        'waiting_for_limiter_s': requests['wait'].sum(),
+        'requesting_s': requests['latency'].sum(),
+        'latency_p50_s': requests['latency'].quantile(0.5),
+        'latency_p95_s': requests['latency'].quantile(0.95),
+        'megabytes': requests['bytes'].fillna(0).sum() / 1e6,
+        'final_rate_per_s': rates.iloc[-1] if len(rates) else requests['rate'].iloc[-1],
+        'highest_rate_per_s': max(rates.max() if len(rates) else 0, requests['rate'].max()),
+    }
+
+
+if __name__ == "__main__":
+    for name, value in summarize_telemetry(*sys.argv[1:2]).items():
+        print(f'{name}: {value}')
@@ -1,4 +1,6 @@
 import pandas as pd
+from fears_io import read_table, write_table
+from smoothing import MovingAverage
 from scipy.stats import kurtosis, skew
 import matplotlib.pyplot as plt
 
@@ -28,15 +30,18 @@ def compare_and_generate_markdown(original_df, compare_df, original_column, comp
 
     return markdown_table
 
-# Placeholder for the actual Excel file paths
-excel_file1 = '/Users/riccardodjordjevic/Desktop/pythonProject2/merged_dataframe_with_first_column25.xlsx'
-excel_file2 = '/Users/riccardodjordjevic/Desktop/pythonProject2/merged_dataframe_with_first_column30.xlsx'
-excel_file3 = '/Users/riccardodjordjevic/Desktop/pythonProject2/merged_dataframe_with_first_column35.xlsx'
+# Placeholder for the actual file paths (.parquet, or .xlsx from older runs)
+excel_file1 = '/Users/riccardodjordjevic/Desktop/pythonProject2/merged_dataframe_with_first_column25.parquet'
+excel_file2 = '/Users/riccardodjordjevic/Desktop/pythonProject2/merged_dataframe_with_first_column30.parquet'
+excel_file3 = '/Users/riccardodjordjevic/Desktop/pythonProject2/merged_dataframe_with_first_column35.parquet'
 
-# Load the datasets from Excel files
-df1 = pd.read_excel(excel_file1)
-df2 = pd.read_excel(excel_file2)
-df3 = pd.read_excel(excel_file3)
+# Set to True to also save the smoothed comparison as .xlsx
+export_excel = False
+
+# Load the datasets
+df1 = read_table(excel_file1)
+df2 = read_table(excel_file2)
+df3 = read_table(excel_file3)
 
 # Perform comparisons and generate Markdown tables
 markdown_table1 = compare_and_generate_markdown(original_df, df1, 'fears25', 'row_average25')
@@ -60,21 +65,19 @@ new_df = pd.DataFrame({
     'NEW FEARS 30': df2['row_average30'],  # row_average30 column of df2
 })
 
-# Add a fourth column for smoothed 'Second Column' (rolling average of 30 rows)
-
-new_df['ORIGINAL FEARS 30 - 60 days smoothing'] = original_df['fears30'].rolling(window=60).mean()
-
-# Add a fifth column for smoothed 'Third Column' (rolling average of 30 rows)
-new_df['NEW FEARS 30 - 60 days smoothing'] = df2['row_average30'].rolling(window=60).mean()
-
-new_df['ORIGINAL FEARS 30 - 120 days smoothing'] = original_df['fears30'].rolling(window=120).mean()
+# Cumulative sums of both indices, from which every smoothing is one subtraction
+original_average = MovingAverage(original_df['fears30'])
+new_average = MovingAverage(df2['row_average30'])
 
-# Add a fifth column for smoothed 'Third Column' (rolling average of 30 rows)
-new_df['NEW FEARS 30 - 120 days smoothing'] = df2['row_average30'].rolling(window=120).mean()
+# Add the 60 and 120 days moving averages of both indices
+for window in (60, 120):
+    new_df[f'ORIGINAL FEARS 30 - {window} days smoothing'] = pd.Series(original_average(window),
+                                                                        index=original_df.index)
+    new_df[f'NEW FEARS 30 - {window} days smoothing'] = pd.Series(new_average(window), index=df2.index)
 
 
 # Print the new DataFrame
 print(new_df)
 
-# To write the new DataFrame to a .csv file
-new_df.to_excel('new_dataframe_with_smoothing.xlsx', index=False)
+# To write the new DataFrame to a Parquet file
+write_table(new_df, 'new_dataframe_with_smoothing.parquet', excel=export_excel)
@@ -0,0 +1,143 @@
+"""Persistent journal of the windows Adj_Interest_vol.py still has to fetch.
+
+Every (keyword, geo, timeframe) window is one job that moves from
+'pending' to 'in_flight' when a worker claims it, then to 'done', or back to
+'pending' when the request fails until its retry budget is spent, and then
+to 'failed'. The journal is an SQLite file and jobs are claimed inside an
+immediate transaction, so several worker processes can drain the same
+journal and a multi-week collection survives reboots.
+"""
+import sqlite3
+import threading
+from time import time
+import pandas as pd
+
+PENDING, IN_FLIGHT, DONE, FAILED = 'pending', 'in_flight', 'done', 'failed'
+
+
+class JobQueue:
+    """SQLite journal of (keyword, geo, timeframe) fetch jobs."""
+
+    def __init__(self, path: str = 'fetch_jobs.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                           'keyword TEXT NOT NULL, geo TEXT NOT NULL, timeframe TEXT NOT NULL, '
+                           'resolution TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, '
+                           'state TEXT NOT NULL DEFAULT \'pending\', attempts INTEGER NOT NULL DEFAULT 0, '
+                           'max_attempts INTEGER NOT NULL, worker TEXT, error TEXT, updated_at REAL NOT NULL, '
+                           'PRIMARY KEY (keyword, geo, timeframe))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, priority DESC, keyword)')
+
+    def _transaction(self, statements):
+        """Runs (sql, params) pairs, or a callable taking the connection,
+        in one immediate transaction and returns the callable's result."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(self._conn) if callable(statements) else [
+                    self._conn.execute(sql, params) for sql, params in statements]
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            return result
+
+    def add(self, jobs, max_attempts: int = 5):
+        """Adds (keyword, geo, timeframe, resolution, priority) jobs. Known
+        jobs keep their state and only have their priority raised."""
+        now = time()
+
+        def insert(conn):
+            conn.executemany('INSERT INTO jobs (keyword, geo, timeframe, resolution, priority, max_attempts, '
+                             'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                             'ON CONFLICT (keyword, geo, timeframe) DO UPDATE SET '
+                             'priority = max(priority, excluded.priority)',
+                             [tuple(job) + (max_attempts, now) for job in jobs])
+        self._transaction(insert)
+
+    def add_keywords(self, keywords: list, geo: str, monthly_timeframe: str, timeframes: list,
+                     priorities: dict = None, store=None, max_attempts: int = 5):
+        """Queues the monthly window and the daily windows of every keyword,
+        leaving out the windows already in `store` (a FetchStore)."""
+        priorities = priorities or {}
+        jobs = []
+        for keyword in keywords:
+            for timeframe, resolution in [(monthly_timeframe, 'monthly')] + [(t, 'daily') for t in timeframes]:
+                if store is None or not store.has(keyword, geo, timeframe):
+                    jobs.append((keyword, geo, timeframe, resolution, priorities.get(keyword, 0)))
+        self.add(jobs, max_attempts=max_attempts)
+
+    def claim(self, worker: str, limit: int = 1) -> list:
+        """Marks the highest priority pending job in flight for `worker`,
+        together with up to limit - 1 other pending jobs for the same window
+        (so they can share a request), and returns them as
+        (keyword, geo, timeframe, resolution, attempts) tuples."""
+        def take(conn):
+            first = conn.execute('SELECT geo, timeframe, resolution FROM jobs WHERE state = ? '
+                                 'ORDER BY priority DESC, keyword, timeframe LIMIT 1', (PENDING,)).fetchone()
+            if first is None:
+                return []
+            rows = conn.execute('SELECT keyword, geo, timeframe, resolution, attempts FROM jobs '
+                                'WHERE state = ? AND geo = ? AND timeframe = ? AND resolution = ? '
+                                'ORDER BY priority DESC, keyword LIMIT ?', (PENDING,) + first + (limit,)).fetchall()
+            conn.executemany('UPDATE jobs SET state = ?, worker = ?, updated_at = ? '
+                             'WHERE keyword = ? AND geo = ? AND timeframe = ?',
+                             [(IN_FLIGHT, worker, time()) + row[:3] for row in rows])
+            return rows
+        return self._transaction(take)
+
+    def complete(self, jobs: list):
+        now = time()
+        self._transaction([('UPDATE jobs SET state = ?, error = NULL, updated_at = ? '
+                            'WHERE keyword = ? AND geo = ? AND timeframe = ?', (DONE, now) + tuple(job[:3]))
+                           for job in jobs])
+
+    def fail(self, jobs: list, error: str):
+        """Puts the jobs back in the queue, or marks them failed once their
+        retry budget is spent."""
+        now = time()
+        self._transaction([('UPDATE jobs SET attempts = attempts + 1, error = ?, updated_at = ?, '
+                            'state = CASE WHEN attempts + 1 >= max_attempts THEN ? ELSE ? END '
+                            'WHERE keyword = ? AND geo = ? AND timeframe = ?',
+                            (error, now, FAILED, PENDING) + tuple(job[:3])) for job in jobs])
+
+    def heartbeat(self, owner: str) -> int:
+        """Marks the jobs in flight for the workers of `owner` (the workers
+        named '{owner}:...') as still alive, so requeue_stale leaves them
+        alone however long their request waits."""
+        owner += ':'
+        cursors = self._transaction([('UPDATE jobs SET updated_at = ? WHERE state = ? AND substr(worker, 1, ?) = ?',
+                                      (time(), IN_FLIGHT, len(owner), owner))])
+        return cursors[0].rowcount
+
+    def requeue_stale(self, timeout: float = 3600.0) -> int:
+        """Returns to the queue the jobs in flight whose worker has not sent
+        a heartbeat for more than `timeout` seconds, i.e. crashed or was
+        killed."""
+        cursors = self._transaction([('UPDATE jobs SET state = ?, worker = NULL WHERE state = ? AND updated_at < ?',
+                                      (PENDING, IN_FLIGHT, time() - timeout))])
+        return cursors[0].rowcount
+
+    def reset_failed(self) -> int:
+        """Gives the failed jobs a new retry budget."""
+        cursors = self._transaction([('UPDATE jobs SET state = ?, attempts = 0 WHERE state = ?', (PENDING, FAILED))])
+        return cursors[0].rowcount
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute('SELECT state, count(*) FROM jobs GROUP BY state').fetchall()
+        return {state: 0 for state in (PENDING, IN_FLIGHT, DONE, FAILED)} | dict(rows)
+
+    def close(self):
+        self._conn.close()
+
+
+def load_priorities(path: str, priority: int = 1) -> dict:
+    """Reads a csv with a 'Keywords' column (for example the keywords of
+    past top-K sets) and gives each of them the same priority."""
+    return {keyword: priority for keyword in pd.read_csv(path)['Keywords']}
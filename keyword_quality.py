@@ -0,0 +1,120 @@
+"""One-pass quality report of the keywords' search volumes.
+
+The FEARS scripts drop the keywords with fewer than 1000 non-zero days, a
+count in which missing days count as non-zero, but only after every series
+was loaded into one wide matrix. The report is computed from each series
+on its own, as it is read (a data_{keyword}.csv file or a row of the
+panel), so only the keywords passing the filter reach the matrix:
+
+- days, missing, zeros, nonzero: days of the series, and how many of them
+  are missing, zero and non-zero;
+- legacy_nonzero: the count the scripts compare with min_nonzero, i.e.
+  the days of all the series together minus the zeros of the keyword;
+- first_date, last_date, span_days, coverage: first and last day with a
+  value, and the share of the days in between that have one;
+- longest_zero_run, zero_run_share: longest run of consecutive zero days
+  and share of the days with a value lying in runs of at least min_run
+  zero days (weeks without any search).
+
+Saved with fears_io.write_table, the report of one run tells the next
+refresh which keywords cannot pass the filter (hopeless_keywords), so they
+need not be fetched again.
+
+    python keyword_quality.py --folder csv --output keyword_quality.parquet
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from fears_io import write_table
+
+
+def zero_runs(values: np.ndarray) -> np.ndarray:
+    """Lengths of the runs of consecutive zeros of `values` (missing values
+    end a run)."""
+    zeros = np.concatenate(([0], (values == 0).view(np.int8), [0]))
+    edges = np.diff(zeros)
+    return np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+
+
+def series_quality(values, dates, min_run: int = 7) -> dict:
+    """Quality of one series of `values` on `dates` (dates or ISO strings,
+    increasing)."""
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    zeros = int(np.count_nonzero(values == 0))
+    quality = {'days': len(values), 'missing': len(values) - int(valid.sum()), 'zeros': zeros,
+               'nonzero': int(valid.sum()) - zeros}
+    rows = np.flatnonzero(valid)
+    if len(rows):
+        first, last = pd.Timestamp(dates[rows[0]]), pd.Timestamp(dates[rows[-1]])
+        span_days = (last - first).days + 1
+        quality.update(first_date=first, last_date=last, span_days=span_days, coverage=len(rows) / span_days)
+    else:
+        quality.update(first_date=pd.NaT, last_date=pd.NaT, span_days=0, coverage=0.0)
+    runs = zero_runs(values)
+    quality['longest_zero_run'] = int(runs.max()) if len(runs) else 0
+    quality['zero_run_share'] = runs[runs >= min_run].sum() / len(rows) if len(rows) else 0.0
+    return quality
+
+
+def _report(qualities, union_days: int) -> pd.DataFrame:
+    report = pd.DataFrame(qualities, columns=['keyword', 'days', 'missing', 'zeros', 'nonzero', 'first_date',
+                                              'last_date', 'span_days', 'coverage', 'longest_zero_run',
+                                              'zero_run_share'])
+    report.insert(5, 'legacy_nonzero', union_days - report['zeros'])
+    return report
+
+
+def quality_report(columns: dict, union_days: int, min_run: int = 7) -> pd.DataFrame:
+    """Report of the series of `columns` ({keyword: date-indexed Series}),
+    which once merged cover `union_days` days."""
+    return _report([{'keyword': keyword, **series_quality(series.to_numpy(), series.index, min_run)}
+                    for keyword, series in columns.items()], union_days)
+
+
+def panel_quality(panel, min_run: int = 7) -> pd.DataFrame:
+    """Report of every keyword of a PanelStore, read one row of the memory
+    map at a time."""
+    values, dates = panel.matrix(), panel.dates
+    return _report([{'keyword': keyword, **series_quality(values[row], dates, min_run)}
+                    for row, keyword in enumerate(panel.keywords)], len(dates))
+
+
+def qualifying_keywords(report: pd.DataFrame, min_nonzero: int = 1000) -> list:
+    """Keywords with a legacy_nonzero of at least min_nonzero, in report
+    order."""
+    return report.loc[report['legacy_nonzero'] >= min_nonzero, 'keyword'].tolist()
+
+
+def hopeless_keywords(report: pd.DataFrame, min_nonzero: int = 1000, new_days: int = 0) -> list:
+    """Keywords that would fail the filter even if all of `new_days` more
+    days were non-zero, and so need not be fetched when refreshing."""
+    return report.loc[report['legacy_nonzero'] + new_days < min_nonzero, 'keyword'].tolist()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Quality report of the search volumes of the keywords.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--folder', help='folder of the data_{keyword}.csv files')
+    source.add_argument('--panel', help='panel folder written by Adj_Interest_vol.py')
+    parser.add_argument('--min-nonzero', type=int, default=1000)
+    parser.add_argument('--min-run', type=int, default=7, help='days of zeros counted in zero_run_share')
+    parser.add_argument('--output', default='keyword_quality.parquet')
+    parser.add_argument('--workers', type=int, default=None, help='processes reading the csv files')
+    args = parser.parse_args(argv)
+
+    if args.panel:
+        from panel_store import PanelStore
+        report = panel_quality(PanelStore(args.panel), args.min_run)
+    else:
+        from fears_engine import read_csv_columns, union_dates
+        columns = read_csv_columns(args.folder, args.workers)
+        report = quality_report(columns, len(union_dates(columns.values())), args.min_run)
+    print(report.to_string(index=False))
+    print(f'{len(qualifying_keywords(report, args.min_nonzero))} of {len(report)} keywords have at least '
+          f'{args.min_nonzero} non-zero observations')
+    print(f"Report saved as '{write_table(report, args.output)}'")
+
+
+if __name__ == "__main__":
+    main()
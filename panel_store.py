@@ -0,0 +1,166 @@
+"""Date x keyword panel of scaled search volumes.
+
+Adj_Interest_vol.py writes the scaled daily series of every keyword into a
+single panel folder instead of one data_{keyword}.csv per keyword, and the
+FEARS scripts map the whole panel into memory at once:
+
+- values.bin (values-{dates}.bin once the dates were extended) holds one
+  row of float values per keyword, one value per date, so adding a keyword
+  appends to the end of the file;
+- meta.json holds the name of the values file, the first date, the number
+  of dates, the dtype and the keywords in row order.
+
+The values file is memory-mapped, so loading even thousands of keywords
+takes no time and no copy: to_frame() returns a DataFrame viewing the map.
+"""
+import json
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+try:
+    import fcntl
+except ImportError:  # Windows: a single process must write the panel
+    fcntl = None
+
+
+class PanelStore:
+    """Memory-mapped date x keyword matrix stored in the folder `path`.
+
+    An existing panel is opened as it is; a new one needs its `dates` (a
+    daily DatetimeIndex) and optionally a dtype, float32 halving its size.
+    """
+
+    def __init__(self, path: str = 'panel', dates: pd.DatetimeIndex = None, dtype: str = 'float64'):
+        self.path = path
+        self._meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(self._meta_path) and dates is None:
+            raise FileNotFoundError(f'No panel in {path}, pass its dates to create one')
+        os.makedirs(path, exist_ok=True)
+        with self._locked():
+            if not os.path.exists(self._meta_path):
+                open(os.path.join(path, 'values.bin'), 'wb').close()
+                self._meta = {'file': 'values.bin', 'start': str(dates[0].date()), 'periods': len(dates),
+                              'dtype': dtype, 'keywords': []}
+                self._save_meta()
+            self._load_meta()
+            # Drop a row left half written by a crash between the two writes
+            # of put(); under the lock, no other process is appending one
+            expected = len(self._index) * self._meta['periods'] * self.dtype.itemsize
+            if os.path.getsize(self._values_path) > expected:
+                with open(self._values_path, 'r+b') as file:
+                    file.truncate(expected)
+
+    @contextmanager
+    def _locked(self):
+        """Holds the lock file of the panel, so that the processes writing
+        to the same panel (e.g. several copies of Adj_Interest_vol.py) append
+        rows and rewrite the meta one at a time."""
+        with open(os.path.join(self.path, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_meta(self):
+        """Reads meta.json again, with the keywords and dates other
+        processes may have added since."""
+        with open(self._meta_path, encoding='utf-8') as file:
+            self._meta = json.load(file)
+        self._values_path = os.path.join(self.path, self._meta['file'])
+        self.dtype = np.dtype(self._meta['dtype'])
+        self._index = {keyword: row for row, keyword in enumerate(self._meta['keywords'])}
+
+    def _save_meta(self):
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self._meta, file)
+        os.replace(tmp_path, self._meta_path)
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        return pd.date_range(self._meta['start'], periods=self._meta['periods'], freq='D', name='date')
+
+    @property
+    def keywords(self) -> list:
+        return list(self._meta['keywords'])
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self._index
+
+    def matrix(self, mode: str = 'r') -> np.ndarray:
+        """The keyword x date memory map (a view, not a copy)."""
+        shape = (len(self._index), self._meta['periods'])
+        if shape[0] == 0:
+            return np.empty(shape, dtype=self.dtype)
+        return np.memmap(self._values_path, dtype=self.dtype, mode=mode, shape=shape)
+
+    def put(self, keyword: str, series: pd.Series):
+        """Writes a keyword's series, aligned on the panel dates by value.
+        Dates the series does not cover are NaN."""
+        with self._locked():
+            self._load_meta()
+            row = series.reindex(self.dates).to_numpy(dtype=self.dtype, na_value=np.nan)
+            if keyword in self._index:
+                values = self.matrix('r+')
+                values[self._index[keyword]] = row
+                values.flush()
+                return
+            with open(self._values_path, 'ab') as file:
+                file.write(row.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            self._index[keyword] = len(self._meta['keywords'])
+            self._meta['keywords'].append(keyword)
+            self._save_meta()
+
+    def series(self, keyword: str) -> pd.Series:
+        return pd.Series(np.array(self.matrix()[self._index[keyword]]), index=self.dates, name=keyword)
+
+    def to_frame(self, keywords: list = None) -> pd.DataFrame:
+        """Date-indexed frame of the panel. Without `keywords` the frame is a
+        view of the memory map; selecting keywords copies those columns."""
+        values = self.matrix().T
+        if keywords is not None:
+            values = values[:, [self._index[keyword] for keyword in keywords]]
+        return pd.DataFrame(values, index=self.dates, columns=self.keywords if keywords is None else keywords, copy=False)
+
+    def extend_dates(self, stop) -> None:
+        """Rewrites the panel with its dates running up to `stop`; the new
+        dates are NaN until the keywords are put again."""
+        with self._locked():
+            self._load_meta()
+            periods = (pd.Timestamp(stop) - pd.Timestamp(self._meta['start'])).days + 1
+            if periods <= self._meta['periods']:
+                return
+            old = self.matrix()
+            new = np.full((old.shape[0], periods), np.nan, dtype=self.dtype)
+            new[:, :old.shape[1]] = old
+            del old
+            # Written next to the old file and switched to through the meta, so a
+            # crash leaves either the old or the new panel
+            old_path = self._values_path
+            self._meta['file'] = f'values-{periods}.bin'
+            self._values_path = os.path.join(self.path, self._meta['file'])
+            new.tofile(self._values_path)
+            self._meta['periods'] = periods
+            self._save_meta()
+            os.remove(old_path)
+
+
+def import_csv_files(folder_path: str, path: str = 'panel', dtype: str = 'float64') -> PanelStore:
+    """Builds a panel from a folder of data_{keyword}.csv files written by
+    earlier versions of Adj_Interest_vol.py (scaled volume in the 6th column)."""
+    files = sorted(file for file in os.listdir(folder_path) if file.startswith('data_') and file.endswith('.csv'))
+    panel = None
+    for file in files:
+        data = pd.read_csv(os.path.join(folder_path, file), index_col=0, parse_dates=True)
+        if data.shape[1] < 5:
+            continue
+        if panel is None:
+            panel = PanelStore(path, dates=pd.date_range(data.index[0], data.index[-1], name='date'), dtype=dtype)
+        panel.put(file[len('data_'):-len('.csv')], data.iloc[:, 4])
+    return panel
@@ -1,9 +1,14 @@
 import pandas as pd
+from fears_io import read_table, write_table
 
-# Load the Excel and CSV files into dataframes
-fears_df = pd.read_excel('merged_dataframe_with_first_column30.xlsx')
-sp500_df = pd.read_excel('/Users/riccardodjordjevic/Desktop/CSV/SP500.xlsx')
-ads_df = pd.read_excel('ADS.xlsx')
+# Set to True to also save reg as .xlsx
+export_excel = False
+
+# Load the Parquet, Excel and CSV files into dataframes. The Excel files are
+# converted once to a binary copy in fears_cache
+fears_df = read_table('merged_dataframe_with_first_column30.parquet')
+sp500_df = read_table('/Users/riccardodjordjevic/Desktop/CSV/SP500.xlsx')
+ads_df = read_table('ADS.xlsx')
 epu_df = pd.read_csv('EPU.csv')  # No date conversion needed
 vix_df = pd.read_csv('VIX.csv')  # Date conversion needed
 
@@ -54,7 +59,7 @@ filtered_df02 = pd.concat([filtered_df.set_index(filtered_df.columns[0]),
 
 
 
-filtered_df02.to_excel('reg.xlsx', index=False)
+write_table(filtered_df02, 'reg.parquet', excel=export_excel)
 
 ret = ['date', 'return', '2day_return']
 sp_ret = sp500_df[ret]
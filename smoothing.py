@@ -0,0 +1,43 @@
+"""Moving averages of the FEARS index from precomputed cumulative sums.
+
+The mean over the last `window` days is a difference of two cumulative
+sums divided by the window, so once the sums are computed every window
+size costs one vectorized subtraction instead of a pass of a rolling
+window. MovingAverage also remembers the windows it has already returned,
+so dragging the smoothing slider of plot_fears back and forth only computes
+each window once.
+"""
+import numpy as np
+
+
+class MovingAverage:
+    """Trailing moving averages of `values` for any window, with the result
+    of Series.rolling(window).mean(): NaN for the first window - 1 days and
+    wherever a value in the window is missing."""
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        missing = np.isnan(values)
+        self.sums = np.zeros(len(values) + 1)
+        np.cumsum(np.where(missing, 0.0, values), out=self.sums[1:])
+        self.missing = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(missing, out=self.missing[1:])
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.sums) - 1
+
+    def __call__(self, window: int) -> np.ndarray:
+        window = int(window)
+        if window not in self.cache:
+            self.cache[window] = self._compute(window)
+        return self.cache[window]
+
+    def _compute(self, window: int) -> np.ndarray:
+        means = np.full(len(self), np.nan)
+        if window < 1 or window > len(self):
+            return means
+        totals = self.sums[window:] - self.sums[:-window]
+        complete = self.missing[window:] == self.missing[:-window]
+        means[window - 1:] = np.where(complete, totals / window, np.nan)
+        return means
@@ -0,0 +1,121 @@
+"""Reusable Google Trends sessions for Adj_Interest_vol.py.
+
+TrendReq fetches a Google cookie when it is constructed and opens a new
+requests session (and TLS connection) for every call it makes. The fetch
+engine used to build a new TrendReq for every window; SessionPool instead
+hands out long-lived PooledTrendReq objects and only replaces one after it
+failed several requests in a row.
+"""
+import json
+import threading
+import requests
+from requests import status_codes
+from pytrends import exceptions
+from pytrends.request import TrendReq
+
+
+class PooledTrendReq(TrendReq):
+    """TrendReq sending all its requests through one requests.Session, so
+    the connection to Google is kept alive between requests. Proxies and
+    the urllib3 retries of TrendReq are not supported."""
+
+    def __init__(self, hl='en-US', tz=360, **kwargs):
+        self.session = requests.Session()
+        self.http_calls = 0
+        self.bytes_received = 0
+        super().__init__(hl=hl, tz=tz, **kwargs)
+        self.session.headers.update(self.headers)
+
+    def _get_data(self, url, method=TrendReq.GET_METHOD, trim_chars=0, **kwargs):
+        self.http_calls += 1
+        if method == TrendReq.POST_METHOD:
+            response = self.session.post(url, timeout=self.timeout, cookies=self.cookies,
+                                         **kwargs, **self.requests_args)
+        else:
+            response = self.session.get(url, timeout=self.timeout, cookies=self.cookies,
+                                        **kwargs, **self.requests_args)
+        self.bytes_received += len(response.content)
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code == 200 and any(kind in content_type for kind in
+                                               ('application/json', 'application/javascript', 'text/javascript')):
+            # Some responses start with garbage characters like ")]}'," before the json
+            return json.loads(response.text[trim_chars:])
+        if response.status_code == status_codes.codes.too_many_requests:
+            raise exceptions.TooManyRequestsError.from_response(response)
+        raise exceptions.ResponseError.from_response(response)
+
+
+class SessionPool:
+    """Thread-safe pool of Trends sessions shared by the fetch workers.
+
+    A session is created (one cookie bootstrap) only when no idle one is
+    available, and is dropped after max_errors failed requests in a row.
+    """
+
+    def __init__(self, trendreq=PooledTrendReq, max_errors: int = 3, hl: str = 'en-US', tz: int = 360):
+        self.trendreq = trendreq
+        self.max_errors = max_errors
+        self.hl = hl
+        self.tz = tz
+        self.created = 0
+        self.acquired = 0
+        self.recycled = 0
+        self.http_calls = 0
+        self._idle = []
+        self._errors = {}
+        self._calls = {}
+        self._bytes = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.acquired += 1
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        session = self.trendreq(hl=self.hl, tz=self.tz)
+        with self._lock:
+            self._errors[id(session)] = 0
+            self._calls[id(session)] = getattr(session, 'http_calls', 0)
+            self._bytes[id(session)] = getattr(session, 'bytes_received', 0)
+        return session
+
+    def release(self, session, failed: bool = False):
+        with self._lock:
+            key = id(session)
+            calls = getattr(session, 'http_calls', 0)
+            self.http_calls += calls - self._calls[key]
+            self._calls[key] = calls
+            received = getattr(session, 'bytes_received', 0)
+            self._local.last_bytes = received - self._bytes[key]
+            self._bytes[key] = received
+            self._errors[key] = self._errors[key] + 1 if failed else 0
+            if self._errors[key] >= self.max_errors:
+                # Start over with a fresh cookie and connection
+                del self._errors[key], self._calls[key], self._bytes[key]
+                self.recycled += 1
+            else:
+                self._idle.append(session)
+
+    def last_bytes(self) -> int:
+        """Bytes received by the last request released by the calling thread."""
+        return getattr(self._local, 'last_bytes', 0)
+
+    def stats(self) -> dict:
+        """Counts of the work saved compared with one new TrendReq per request.
+
+        Every request made on a reused session avoided a cookie bootstrap,
+        and every HTTP call after the first one on a session avoided a TLS
+        handshake (a new TrendReq needs one for the bootstrap and one for
+        each of its calls).
+        """
+        with self._lock:
+            bootstraps_avoided = self.acquired - self.created
+            return {
+                'sessions_created': self.created,
+                'sessions_recycled': self.recycled,
+                'requests': self.acquired,
+                'bootstraps_avoided': bootstraps_avoided,
+                'handshakes_avoided': max(self.http_calls - self.created, 0) + bootstraps_avoided,
+            }
@@ -0,0 +1,121 @@
+"""Local stand-in for the Google Trends endpoint.
+
+StubTrendReq mimics the parts of pytrends.request.TrendReq used by
+Adj_Interest_vol.py so that the fetch engine can be benchmarked offline.
+The stub answers with a fixed latency, enforces a server side request rate
+(raising TooManyRequestsError like Google does) and returns deterministic
+data normalised the way Trends normalises it: the highest point among all
+the keywords of a payload is 100, and windows longer than 269 days are
+returned at monthly resolution.
+"""
+from datetime import date
+from time import sleep, monotonic
+from types import SimpleNamespace
+from zlib import crc32
+import threading
+import numpy as np
+import pandas as pd
+from pytrends.exceptions import TooManyRequestsError
+
+
+class _Server:
+    """Sliding one minute window of accepted requests shared by every stub session."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accepted = []
+        self.requests = 0
+        self.rejected = 0
+
+    def admit(self, limit_per_minute: float) -> bool:
+        with self.lock:
+            now = monotonic()
+            self.requests += 1
+            self.accepted = [t for t in self.accepted if now - t < 60]
+            if len(self.accepted) >= limit_per_minute:
+                self.rejected += 1
+                return False
+            self.accepted.append(now)
+            return True
+
+
+server = _Server()
+
+
+def _latent_volume(keyword: str, index: pd.DatetimeIndex) -> np.ndarray:
+    """Deterministic daily search volume of a keyword, before normalisation."""
+    start = pd.Timestamp('2004-01-01')
+    days = (index - start).days.to_numpy()
+    rng = np.random.default_rng(crc32(keyword.encode()))
+    level = rng.uniform(5, 50)
+    trend = rng.uniform(-0.5, 0.5)
+    phase = rng.uniform(0, 2 * np.pi)
+    # Hash the day number with the keyword so any window gives the same values
+    noise = np.array([crc32(f'{keyword}:{d}'.encode()) for d in days]) / 2 ** 32
+    weekly = 1 + 0.15 * np.sin(2 * np.pi * days / 7 + phase)
+    return np.maximum(level * (1 + trend * days / 3000) * weekly * (0.7 + 0.6 * noise), 0)
+
+
+class StubTrendReq:
+    """Offline replacement for TrendReq(hl, tz)."""
+
+    latency = 0.05  # seconds per request
+    limit_per_minute = 600  # requests accepted per minute before answering 429
+    bootstrap_latency = 0.0  # seconds spent fetching the cookie on construction
+
+    def __init__(self, hl='en-US', tz=360, **kwargs):
+        self.hl = hl
+        self.tz = tz
+        self.kw_list = []
+        self.timeframe = None
+        self.geo = ''
+        self.http_calls = 0
+        self.bytes_received = 0
+        sleep(self.bootstrap_latency)
+
+    def build_payload(self, kw_list, cat=0, timeframe='today 5-y', geo='', gprop=''):
+        self.http_calls += 1
+        sleep(self.latency)
+        if not server.admit(self.limit_per_minute):
+            raise TooManyRequestsError('The request failed: Google returned a response with code 429',
+                                       response=SimpleNamespace(status_code=429))
+        self.kw_list = list(kw_list)
+        self.timeframe = timeframe
+        self.geo = geo
+
+    def interest_over_time(self) -> pd.DataFrame:
+        self.http_calls += 1
+        start, stop = (date.fromisoformat(part) for part in self.timeframe.split())
+        index = pd.date_range(start, stop, freq='D', name='date')
+        frame = pd.DataFrame({kw: _latent_volume(kw, index) for kw in self.kw_list}, index=index)
+        if len(index) > 269:
+            frame = frame.resample('MS').sum()
+            frame.index.name = 'date'
+        peak = frame.to_numpy().max()
+        if peak > 0:
+            frame = (frame / peak * 100).round()
+        frame = frame.astype(int)
+        frame['isPartial'] = False
+        self.bytes_received += len(frame.to_json())
+        return frame
+
+
+if __name__ == "__main__":
+    from Adj_Interest_vol import TokenBucket, get_daily_data_many
+    from trends_session import SessionPool
+
+    # Benchmark parameters: a short range keeps the run under a minute
+    keywords = [f'keyword {i}' for i in range(4)]
+    StubTrendReq.latency = 0.5
+    StubTrendReq.limit_per_minute = 240
+    StubTrendReq.bootstrap_latency = 0.3
+
+    for workers in (1, 4, 8):
+        limiter = TokenBucket(rate=3.0, burst=workers, cooldown=2.0)
+        pool = SessionPool(StubTrendReq)
+        started = monotonic()
+        get_daily_data_many(keywords, 2011, 1, 2011, 12, verbose=False, workers=workers,
+                            limiter=limiter, pool=pool)
+        elapsed = monotonic() - started
+        print(f'{workers} workers: {limiter.sent} requests in {elapsed:.1f} s '
+              f'({limiter.requests_per_minute():.1f} requests/min), {pool.stats()}')